@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, Response, stream_with_context
 import sqlite3
 import json
 from datetime import datetime
@@ -7,8 +7,24 @@ from collections import defaultdict, deque
 import time
 import os
 import random
+import socket
 import subprocess
+import sys
 import psutil
+import asyncio
+import queue
+import itertools
+import calendar
+import bisect
+import math
+import heapq
+import functools
+import contextlib
+import csv
+import io
+import zlib
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from types import MappingProxyType
 
 app = Flask(__name__)
 
@@ -16,24 +32,574 @@ app = Flask(__name__)
 debug_on = False
 
 # In-memory storage for real-time data
-active_sessions = {}
 recent_events = deque(maxlen=100)
-
-# Authorization storage
-authorized_sessions = {}  # session_id -> device info
-connection_to_session_map = {}  # connection_code -> session_id
 session_timeout = 300  # 5 minutes for session to be used
 
-# Dashboard connections storage
-dashboard_connections = {}  # session_id -> connection_data
+class SessionRecord:
+    """Device slot from take_slot until it is used, expired or removed"""
+
+    __slots__ = (
+        'session_id', 'serial_id', 'client_ip', 'server_slot', 'created_at',
+        'status', 'connection_code', 'authorized', 'mapped', 'on_dashboard',
+        'server_connected', 'server_ip', 'server_connect_time', 'server_disconnect_time',
+        'viewer_connected', 'viewer_ip', 'viewer_connect_time', 'viewer_disconnect_time'
+    )
+
+    def __init__(self, session_id, serial_id, client_ip, server_slot, created_at):
+        self.session_id = session_id
+        self.serial_id = serial_id
+        self.client_ip = client_ip
+        self.server_slot = server_slot
+        self.created_at = created_at
+        self.status = 'ready'
+        self.connection_code = None
+        self.authorized = True  # waiting to be used by a VNC client
+        self.mapped = False  # connection code linked and session not used yet
+        self.on_dashboard = True
+        self.server_connected = False
+        self.server_ip = ''
+        self.server_connect_time = None
+        self.server_disconnect_time = None
+        self.viewer_connected = False
+        self.viewer_ip = ''
+        self.viewer_connect_time = None
+        self.viewer_disconnect_time = None
+
+class ActiveSession:
+    """Repeater-side session keyed by connection code"""
+
+    __slots__ = (
+        'connection_code', 'server_ip', 'viewer_ip', 'mode', 'start_time',
+        'server_index', 'viewer_index', 'status', 'session_id'
+    )
+
+    def __init__(self, connection_code, server_ip='', viewer_ip='', mode=0, start_time=0,
+                 server_index=-1, viewer_index=-1, status='waiting_for_viewer', session_id=None):
+        self.connection_code = connection_code
+        self.server_ip = server_ip
+        self.viewer_ip = viewer_ip
+        self.mode = mode
+        self.start_time = start_time
+        self.server_index = server_index
+        self.viewer_index = viewer_index
+        self.status = status
+        self.session_id = session_id
+
+class SessionRegistry:
+    """Single store for device sessions with O(1) secondary indexes.
+
+    A SessionRecord stays registered while it is authorized or shown on the
+    dashboard. All changes go through add()/update() so the indexes by
+    connection code, pending client IP and serial_id stay consistent.
+    """
+
+    shared = False  # state visible to this process only
+
+    def __init__(self):
+        self.sessions = {}  # session_id -> SessionRecord
+        self.by_code = {}  # connection_code -> session_id
+        self.pending_by_ip = {}  # client_ip -> {session_id: None}, oldest first
+        self.by_serial = {}  # serial_id -> {session_id: None}
+        self.active = {}  # connection_code -> ActiveSession
+        self.authorized_count = 0
+        self.dashboard_count = 0
+        self.pending_count = 0  # authorized, not linked to a connection code yet
+        self.listeners = []  # callables (record, was_on_dashboard) run after each change
+        self.id_counters = {}  # name -> next id for reserve_ids()
+        self.values = {}  # name -> scalar shared by all workers, see get_value()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Group of changes applied atomically; a no-op for process memory"""
+        yield
+
+    def changed(self):
+        """True when another process changed the state since the last call"""
+        return False
+
+    def reserve_ids(self, name, count, floor=0):
+        """Reserve count consecutive ids above floor, returns the first one"""
+        first = max(self.id_counters.get(name, 0), floor + 1)
+        self.id_counters[name] = first + count
+        return first
+
+    def get_value(self, name, default=None):
+        """Scalar such as the repeater's MaxSessions, set by whichever worker hears it"""
+        return self.values.get(name, default)
+
+    def set_value(self, name, value):
+        self.values[name] = value
+
+    @property
+    def active_count(self):
+        return len(self.active)
+
+    def __contains__(self, session_id):
+        return session_id in self.sessions
+
+    def get(self, session_id):
+        return self.sessions.get(session_id)
+
+    def get_by_code(self, connection_code):
+        session_id = self.by_code.get(connection_code)
+        return self.sessions.get(session_id) if session_id is not None else None
+
+    def find_pending(self, client_ip):
+        """Oldest authorized session from client_ip without a connection code"""
+        pending = self.pending_by_ip.get(client_ip)
+        if pending:
+            return self.sessions[next(iter(pending))]
+        return None
+
+    def find_by_serial(self, serial_id):
+        return [self.sessions[sid] for sid in self.by_serial.get(serial_id, ())]
+
+    def authorized_records(self):
+        return [record for record in list(self.sessions.values()) if record.authorized]
+
+    def dashboard_records(self):
+        return [record for record in list(self.sessions.values()) if record.on_dashboard]
+
+    def add(self, record):
+        self.sessions[record.session_id] = record
+        self.by_serial.setdefault(record.serial_id, {})[record.session_id] = None
+        if record.connection_code is not None:
+            self.by_code[record.connection_code] = record.session_id
+        if self._is_pending(record):
+            self.pending_by_ip.setdefault(record.client_ip, {})[record.session_id] = None
+            self.pending_count += 1
+        self.authorized_count += record.authorized
+        self.dashboard_count += record.on_dashboard
+        self._notify(record, False)
+
+    def update(self, record, **fields):
+        """Change record fields, keeping indexes and counters in step"""
+        if self.sessions.get(record.session_id) is not record:
+            return
+        was_pending = self._is_pending(record)
+        old_code = record.connection_code
+        was_authorized = record.authorized
+        was_on_dashboard = record.on_dashboard
+        for name, value in fields.items():
+            setattr(record, name, value)
+        if record.connection_code != old_code:
+            self._unindex_code(old_code, record.session_id)
+            if record.connection_code is not None:
+                self.by_code[record.connection_code] = record.session_id
+        is_pending = self._is_pending(record)
+        if was_pending and not is_pending:
+            self._unindex(self.pending_by_ip, record.client_ip, record.session_id)
+            self.pending_count -= 1
+        elif is_pending and not was_pending:
+            self.pending_by_ip.setdefault(record.client_ip, {})[record.session_id] = None
+            self.pending_count += 1
+        self.authorized_count += record.authorized - was_authorized
+        self.dashboard_count += record.on_dashboard - was_on_dashboard
+        if not record.authorized and not record.on_dashboard:
+            self._drop(record)
+        self._notify(record, was_on_dashboard)
+
+    def _notify(self, record, was_on_dashboard):
+        for listener in self.listeners:
+            try:
+                listener(record, was_on_dashboard)
+            except Exception as e:
+                debug_log(f"❌ Session listener error: {e}")
+
+    def _drop(self, record):
+        del self.sessions[record.session_id]
+        self._unindex_code(record.connection_code, record.session_id)
+        self._unindex(self.by_serial, record.serial_id, record.session_id)
+
+    def _unindex_code(self, connection_code, session_id):
+        if connection_code is not None and self.by_code.get(connection_code) == session_id:
+            del self.by_code[connection_code]
+
+    @staticmethod
+    def _unindex(index, key, session_id):
+        ids = index.get(key)
+        if ids is not None:
+            ids.pop(session_id, None)
+            if not ids:
+                del index[key]
+
+    @staticmethod
+    def _is_pending(record):
+        return record.authorized and record.connection_code is None
+
+    def get_active(self, connection_code):
+        return self.active.get(connection_code)
+
+    def set_active(self, active_session):
+        self.active[active_session.connection_code] = active_session
+
+    def update_active(self, connection_code, **fields):
+        active_session = self.active[connection_code]
+        for name, value in fields.items():
+            setattr(active_session, name, value)
+
+    def pop_active(self, connection_code):
+        return self.active.pop(connection_code, None)
+
+class SqliteSessionRegistry:
+    """SessionRegistry interface over a shared SQLite database in WAL mode.
+
+    Lets several worker processes (or hosts on a shared volume) serve
+    take_slot, repeater events and the dashboard from one state. It is the
+    local stand-in for a networked store: a KV backend implements the same
+    methods, with transaction() mapped to its own atomic batch or lock.
+    Records returned here are copies; changes go through update().
+    """
+
+    shared = True
+    BOOL_FIELDS = ('authorized', 'mapped', 'on_dashboard', 'server_connected', 'viewer_connected')
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.listeners = []
+        self.data_version = None
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(f'''
+            CREATE TABLE IF NOT EXISTS state_sessions (
+                {', '.join(SessionRecord.__slots__)},
+                PRIMARY KEY (session_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_state_sessions_code ON state_sessions(connection_code);
+            CREATE INDEX IF NOT EXISTS idx_state_sessions_serial ON state_sessions(serial_id);
+            CREATE INDEX IF NOT EXISTS idx_state_sessions_pending
+                ON state_sessions(client_ip, created_at) WHERE authorized AND connection_code IS NULL;
+            CREATE TABLE IF NOT EXISTS state_active (
+                {', '.join(ActiveSession.__slots__)},
+                PRIMARY KEY (connection_code)
+            );
+            CREATE TABLE IF NOT EXISTS state_counters (
+                name TEXT PRIMARY KEY,
+                next_id INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS state_values (
+                name TEXT PRIMARY KEY,
+                value
+            );
+        ''')
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def _record(self, row):
+        if row is None:
+            return None
+        record = SessionRecord.__new__(SessionRecord)
+        for name, value in zip(SessionRecord.__slots__, row):
+            setattr(record, name, bool(value) if name in self.BOOL_FIELDS else value)
+        return record
+
+    def _records(self, where, params=()):
+        rows = self._conn().execute(f'SELECT * FROM state_sessions WHERE {where}', params)
+        return [self._record(row) for row in rows]
+
+    @contextlib.contextmanager
+    def transaction(self):
+        conn = self._conn()
+        if conn.in_transaction:
+            yield
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def changed(self):
+        version = self._conn().execute('PRAGMA data_version').fetchone()[0]
+        changed, self.data_version = version != self.data_version, version
+        return changed
+
+    def reserve_ids(self, name, count, floor=0):
+        conn = self._conn()
+        with self.transaction():
+            conn.execute('INSERT OR IGNORE INTO state_counters (name, next_id) VALUES (?, 0)', (name,))
+            conn.execute('UPDATE state_counters SET next_id = MAX(next_id, ?) + ? WHERE name = ?',
+                         (floor + 1, count, name))
+            next_id = conn.execute('SELECT next_id FROM state_counters WHERE name = ?', (name,)).fetchone()[0]
+        return next_id - count
+
+    def get_value(self, name, default=None):
+        row = self._conn().execute('SELECT value FROM state_values WHERE name = ?', (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_value(self, name, value):
+        self._conn().execute('''
+            INSERT INTO state_values (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = excluded.value
+        ''', (name, value))
+
+    @property
+    def authorized_count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM state_sessions WHERE authorized').fetchone()[0]
+
+    @property
+    def dashboard_count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM state_sessions WHERE on_dashboard').fetchone()[0]
+
+    @property
+    def pending_count(self):
+        return self._conn().execute(
+            'SELECT COUNT(*) FROM state_sessions WHERE authorized AND connection_code IS NULL').fetchone()[0]
+
+    @property
+    def active_count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM state_active').fetchone()[0]
+
+    def __contains__(self, session_id):
+        return self._conn().execute(
+            'SELECT 1 FROM state_sessions WHERE session_id = ?', (session_id,)).fetchone() is not None
+
+    def get(self, session_id):
+        records = self._records('session_id = ?', (session_id,))
+        return records[0] if records else None
+
+    def get_by_code(self, connection_code):
+        records = self._records('connection_code = ? ORDER BY created_at DESC LIMIT 1', (connection_code,))
+        return records[0] if records else None
+
+    def find_pending(self, client_ip):
+        records = self._records('client_ip = ? AND authorized AND connection_code IS NULL '
+                                'ORDER BY created_at LIMIT 1', (client_ip,))
+        return records[0] if records else None
+
+    def find_by_serial(self, serial_id):
+        return self._records('serial_id = ? ORDER BY created_at', (serial_id,))
+
+    def authorized_records(self):
+        return self._records('authorized')
+
+    def dashboard_records(self):
+        return self._records('on_dashboard')
+
+    def add(self, record):
+        values = [getattr(record, name) for name in SessionRecord.__slots__]
+        self._conn().execute(
+            f'INSERT INTO state_sessions VALUES ({", ".join("?" * len(values))})', values)
+        self._notify(record, False)
+
+    def update(self, record, **fields):
+        conn = self._conn()
+        was_on_dashboard = record.on_dashboard
+        for name, value in fields.items():
+            setattr(record, name, value)
+        if not record.authorized and not record.on_dashboard:
+            cursor = conn.execute('DELETE FROM state_sessions WHERE session_id = ?', (record.session_id,))
+        else:
+            cursor = conn.execute(
+                f'UPDATE state_sessions SET {", ".join(f"{name} = ?" for name in fields)} WHERE session_id = ?',
+                [*fields.values(), record.session_id])
+        if cursor.rowcount:
+            self._notify(record, was_on_dashboard)
+
+    _notify = SessionRegistry._notify
+
+    def get_active(self, connection_code):
+        row = self._conn().execute(
+            'SELECT * FROM state_active WHERE connection_code = ?', (connection_code,)).fetchone()
+        return ActiveSession(*row) if row else None
+
+    def set_active(self, active_session):
+        values = [getattr(active_session, name) for name in ActiveSession.__slots__]
+        self._conn().execute(
+            f'INSERT OR REPLACE INTO state_active VALUES ({", ".join("?" * len(values))})', values)
+
+    def update_active(self, connection_code, **fields):
+        self._conn().execute(
+            f'UPDATE state_active SET {", ".join(f"{name} = ?" for name in fields)} WHERE connection_code = ?',
+            [*fields.values(), connection_code])
+
+    def pop_active(self, connection_code):
+        active_session = self.get_active(connection_code)
+        if active_session is not None:
+            self._conn().execute('DELETE FROM state_active WHERE connection_code = ?', (connection_code,))
+        return active_session
+
+# Session state backend: 'memory' for a single process, 'sqlite' to share
+# state between worker processes through UVNC_STATE_DB
+STATE_BACKEND = os.environ.get('UVNC_STATE_BACKEND', 'memory')
+STATE_DB_PATH = os.environ.get('UVNC_STATE_DB', '/tmp/repeater_state.db')
+STATE_SYNC_INTERVAL = 1.0  # seconds between checks for changes made by other processes
+
+def create_state_backend(name):
+    if name == 'sqlite':
+        return SqliteSessionRegistry(STATE_DB_PATH)
+    if name != 'memory':
+        raise ValueError(f"Unknown UVNC_STATE_BACKEND: {name}")
+    return SessionRegistry()
+
+session_registry = create_state_backend(STATE_BACKEND)
+
+class StateEngine:
+    """Single owner thread for session state.
+
+    Every mutation of session_registry runs here as a command, in submission
+    order. After each drained batch of commands the engine publishes a new
+    copy-on-write dashboard snapshot (session_id -> serialized connection);
+    readers use it without locks and never wait for event ingestion.
+    """
+
+    def __init__(self, batch_size=256):
+        self.commands = queue.Queue()
+        self.batch_size = batch_size
+        self.snapshot = MappingProxyType({})
+        self.snapshot_listeners = []  # callables (snapshot) run after each swap
+        self.dirty = set()
+        self.queue_latency = 0.0  # seconds the last batch's oldest command waited
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='state-engine', daemon=True)
+            self.thread.start()
+
+    def submit(self, func, *args):
+        """Queue func(*args) for the engine thread, returns a Future"""
+        future = Future()
+        self.commands.put((func, args, future, time.monotonic()))
+        return future
+
+    def call(self, func, *args, timeout=10):
+        """Run func(*args) on the engine thread and wait for its result"""
+        if threading.current_thread() is self.thread:
+            return func(*args)
+        return self.submit(func, *args).result(timeout)
+
+    def mark_dirty(self, record, was_on_dashboard):
+        """Registry listener collecting sessions to refresh in the next snapshot"""
+        if record.on_dashboard or was_on_dashboard:
+            self.dirty.add(record.session_id)
 
-# Websockify process
-websockify_process = None
-WEBSOCKIFY_PORT = 6080
+    def run(self):
+        while True:
+            try:
+                batch = [self.commands.get(timeout=STATE_SYNC_INTERVAL)]
+                self.queue_latency = time.monotonic() - batch[0][3]
+            except queue.Empty:
+                batch = []
+                self.queue_latency = 0.0
+            while batch and len(batch) < self.batch_size:
+                try:
+                    batch.append(self.commands.get_nowait())
+                except queue.Empty:
+                    break
+            results = self.run_batch(batch) if batch else []
+            try:
+                if session_registry.changed():
+                    self.resync()
+                elif self.dirty:
+                    self.publish_snapshot()
+            except Exception as e:
+                debug_log(f"❌ Snapshot update failed: {e}")
+            # Callers are released after the swap, so they read their own changes
+            for future, result, error in results:
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
 
-# Repeater and websockify heartbeat tracking
+    def run_batch(self, batch):
+        """Run commands in one backend transaction, returns (future, result, error) tuples"""
+        results = []
+        try:
+            with session_registry.transaction():
+                for func, args, future, _ in batch:
+                    try:
+                        results.append((future, func(*args), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            # Commit failed, nothing from this batch was applied
+            self.dirty.clear()
+            results = [(future, None, e) for _, _, future, _ in batch]
+        return results
+
+    def publish_snapshot(self):
+        """Swap in a new snapshot and send the coalesced deltas to dashboard streams"""
+        previous = self.snapshot
+        current = dict(previous)
+        deltas = []
+        for session_id in self.dirty:
+            record = session_registry.get(session_id)
+            if record is not None and record.on_dashboard:
+                current[session_id] = serialize_connection(record)
+                deltas.append(('updated' if session_id in previous else 'added', current[session_id]))
+            elif current.pop(session_id, None) is not None:
+                deltas.append(('removed', {'session_id': session_id}))
+        self.swap_snapshot(current, deltas)
+
+    def resync(self):
+        """Rebuild the snapshot after another process changed shared state"""
+        previous = self.snapshot
+        current = {record.session_id: serialize_connection(record)
+                   for record in session_registry.dashboard_records()}
+        deltas = [('updated' if session_id in previous else 'added', data)
+                  for session_id, data in current.items() if previous.get(session_id) != data]
+        deltas.extend(('removed', {'session_id': session_id})
+                      for session_id in previous if session_id not in current)
+        self.swap_snapshot(current, deltas)
+
+    def swap_snapshot(self, current, deltas):
+        self.dirty.clear()
+        self.snapshot = MappingProxyType(current)
+        for event, data in deltas:
+            publish_dashboard_event(event, data)
+        for listener in self.snapshot_listeners:
+            try:
+                listener(self.snapshot)
+            except Exception as e:
+                debug_log(f"❌ Snapshot listener error: {e}")
+
+state_engine = StateEngine()
+session_registry.listeners.append(state_engine.mark_dirty)
+state_engine.start()
+
+# Event database and write-behind settings
+DB_PATH = os.environ.get('UVNC_EVENTS_DB', '/tmp/repeater_events.db')
+DB_WRITE_QUEUE_SIZE = 10000  # queued statements before producers block
+DB_FLUSH_INTERVAL = 0.5  # seconds to gather a group commit
+DB_BATCH_SIZE = 500  # queued statements per group commit
+DB_ENQUEUE_TIMEOUT = 5  # seconds a producer may block on a full queue
+
+# Event partitioning and retention
+EVENT_PARTITION = os.environ.get('UVNC_EVENT_PARTITION', 'month')  # 'day' or 'month'
+EVENT_RETENTION_DAYS = int(os.environ.get('UVNC_EVENT_RETENTION_DAYS', 90))
+EVENT_ARCHIVE_DIR = os.environ.get('UVNC_EVENT_ARCHIVE_DIR', '')  # archive dropped partitions here
+RETENTION_INTERVAL = 3600  # seconds between retention/vacuum runs
+
+# WebSocket proxy for noVNC viewers: vncproxy.py worker processes sharing
+# VNC_PROXY_PORT with SO_REUSEPORT
+vnc_proxy = None
+VNC_PROXY_PORT = 6080
+VNC_PROXY_WORKERS = int(os.environ.get('UVNC_VNC_PROXY_WORKERS', os.cpu_count() or 1))
+VNC_PROXY_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vncproxy.py')
+VNC_PROXY_HEALTH_TIMEOUT = 15  # seconds without a worker message before it is restarted
+VNC_PROXY_RESTART_DELAY = 1  # first restart delay, doubled while a worker keeps crashing
+VNC_PROXY_MAX_RESTART_DELAY = 30
+VNC_PROXY_STABLE_UPTIME = 60  # uptime after which the restart delay resets
+VNC_TRAFFIC_PUBLISH_INTERVAL = 1  # seconds between traffic pushes to dashboard streams
+VNC_REPEATER_HOST = '127.0.0.1'
+VNC_REPEATER_PORT = 5900  # repeater viewer port
+
+# Repeater event stream listener (eventinterface section of uvncrepeater.ini)
+EVENT_LISTENER_HOST = '127.0.0.1'
+EVENT_LISTENER_PORT = 2002
+
+# Repeater heartbeat tracking
 repeater_last_heartbeat = 0
-websockify_last_heartbeat = 0
 HEARTBEAT_TIMEOUT = 120  # 2 minutes
 
 # Set static folder
@@ -45,6 +611,118 @@ def debug_log(message):
         timestamp = datetime.now().strftime('%H:%M:%S')
         print(f"🐛 [{timestamp}] {message}")
 
+# Prometheus-style metrics, rendered by /metrics
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+metrics_registry = []
+
+class Counter:
+    """Monotonic counter, optionally split by one label"""
+
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def inc(self, label_value=None, amount=1):
+        with self.lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = list(self.values.items())
+        for label_value, value in values:
+            labels = f'{{{self.label}="{label_value}"}}' if self.label else ''
+            lines.append(f"{self.name}{labels} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values (seconds)"""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+        metrics_registry.append(self)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+
+    def __init__(self, name, help_text, callback):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        metrics_registry.append(self)
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.callback()}"]
+
+class LabeledGauge:
+    """Gauge family read at scrape time; callback yields (label values, value)"""
+
+    def __init__(self, name, help_text, labels, callback):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.callback = callback
+        metrics_registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for label_values, value in self.callback():
+            labels = ','.join(f'{label}="{label_value}"' for label, label_value in zip(self.labels, label_values))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+def timed(histogram):
+    """Decorator observing the wrapped function's run time"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+EVENTS_TOTAL = Counter('uvnc_events_total', 'Repeater events received', 'event_type')
+PARSE_SECONDS = Histogram('uvnc_parse_event_seconds', 'parse_event_data latency')
+STORE_SECONDS = Histogram('uvnc_store_event_seconds', 'store_events latency (queueing for the DB writer)')
+PROCESS_SECONDS = Histogram('uvnc_process_event_seconds', 'process_event latency')
+HANDLE_EVENT_SECONDS = Histogram('uvnc_handle_event_seconds', 'Full /api/event request latency')
+CLEANUP_SWEEP_SECONDS = Histogram('uvnc_cleanup_sweep_seconds', 'cleanup_expired_sessions duration')
+EXPIRED_TOTAL = Counter('uvnc_expired_total', 'Deadlines fired by the expiry scheduler', 'kind')
+
 # Check if noVNC exists
 NOVNC_PATH = os.path.join(app.static_folder, 'noVNC')
 if not os.path.exists(NOVNC_PATH):
@@ -52,7 +730,9 @@ if not os.path.exists(NOVNC_PATH):
 
 # Initialize SQLite database
 def init_db():
-    conn = sqlite3.connect('/tmp/repeater_events.db')
+    conn = sqlite3.connect(DB_PATH)
+    # Takes effect immediately on a new database, before any table exists
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
     c = conn.cursor()
     
     c.execute('''
@@ -85,95 +765,685 @@ def init_db():
     ''')
     
     conn.commit()
+    migrate_db(conn)
     conn.close()
 
+# Schema migrations, applied in order; PRAGMA user_version = number applied
+SCHEMA_MIGRATIONS = (
+    # 1: indexes for filtered, keyset-paginated event queries (rowid is implicit)
+    (
+        'CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events (timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_events_type_timestamp ON events (event_type, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_events_connection_code ON events (connection_code, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_events_viewer_ip ON events (viewer_ip, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_events_server_ip ON events (server_ip, timestamp)',
+    ),
+    # 2: coalesced heartbeats - one liveness row per repeater PID plus outage intervals
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS repeater_liveness (
+            repeater_pid INTEGER PRIMARY KEY,
+            first_seen INTEGER,
+            last_seen INTEGER,
+            heartbeat_count INTEGER DEFAULT 0,
+            max_sessions INTEGER DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS repeater_outages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            repeater_pid INTEGER,
+            started_at INTEGER,
+            ended_at INTEGER,
+            duration INTEGER
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_repeater_outages_started_at ON repeater_outages (started_at)',
+    ),
+    # 3: time-partitioned events; the legacy events table becomes one partition
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS event_partitions (
+            name TEXT PRIMARY KEY,
+            start_ts INTEGER,
+            end_ts INTEGER
+        )
+        ''',
+        '''
+        INSERT OR IGNORE INTO event_partitions (name, start_ts, end_ts)
+        SELECT 'events', MIN(timestamp), MAX(timestamp) + 1 FROM events
+        HAVING COUNT(*) > 0
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_device_auth_created_at ON device_auth (created_at)',
+    ),
+    # 4: finished sessions and their hourly rollups
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            connection_code INTEGER,
+            session_id INTEGER,
+            serial_id TEXT,
+            server_ip TEXT,
+            viewer_ip TEXT,
+            start_ts INTEGER,
+            end_ts INTEGER,
+            duration INTEGER,
+            end_reason TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_end_ts ON sessions (end_ts)',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_server_ip ON sessions (server_ip, end_ts)',
+        '''
+        CREATE TABLE IF NOT EXISTS session_rollups (
+            hour_ts INTEGER,
+            server_ip TEXT,
+            session_count INTEGER,
+            total_duration INTEGER,
+            max_duration INTEGER,
+            duration_buckets TEXT,
+            PRIMARY KEY (hour_ts, server_ip)
+        )
+        ''',
+    ),
+    # 5: slot creation time at full precision (created_at keeps whole seconds)
+    (
+        'ALTER TABLE device_auth ADD COLUMN created_ts REAL',
+    ),
+    # 6: manual dashboard removals, replayed after a restart like device_auth rows
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS dashboard_removals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER,
+            removed_at REAL
+        )
+        ''',
+    ),
+)
+
+# Schema version that introduced event partitions
+PARTITIONED_EVENTS_VERSION = 3
+
+def migrate_db(conn):
+    """Enable WAL and apply pending schema migrations"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    # Dropped partitions give space back via incremental vacuum; a database
+    # from before partitioning needs one full VACUUM to switch over, done
+    # once while upgrading it (new databases get the mode in init_db)
+    if version < PARTITIONED_EVENTS_VERSION and conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        print("Upgrading events database to incremental vacuum, this may take a while...")
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+    # WAL lets API readers run alongside the background writer
+    conn.execute('PRAGMA journal_mode=WAL')
+    for number, statements in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        debug_log(f"🛠️ Applying DB migration {number}")
+        with conn:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {number}')
+
 init_db()
 
-def start_websockify():
-    """Start single websockify process for all VNC connections"""
-    global websockify_process
-    
-    try:
-        # Stop if already running
-        stop_websockify()
-        
-        # Check if UltraVNC repeater is running
-        if not is_ultravnc_repeater_running():
-            debug_log("Warning: UltraVNC repeater not found on port 5500")
-        
-        # Get path to websockify
-        venv_bin = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'venv', 'bin')
-        websockify_cmd = os.path.join(venv_bin, 'websockify')
-        
-        # Fallback to system websockify
-        if not os.path.exists(websockify_cmd):
-            websockify_cmd = 'websockify'
-        
-        # Use 0.0.0.0 to bind to all interfaces, not just localhost
-        cmd = [
-            websockify_cmd,
-            f'0.0.0.0:{WEBSOCKIFY_PORT}',
-            f'127.0.0.1:5900',  # Connect to local UltraVNC repeater
-            '--web', NOVNC_PATH,
-            '--heartbeat', '30',
-            '--verbose'
-        ]
-        
-        debug_log(f"Starting websockify: {' '.join(cmd)}")
-        
-        # Start websockify process
-        websockify_process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        
-        # Start heartbeat monitoring for websockify
-        threading.Thread(target=monitor_websockify_heartbeat, daemon=True).start()
-        
-        # Wait and check if started successfully
-        time.sleep(3)
-        
-        if websockify_process.poll() is not None:
-            stdout, stderr = websockify_process.communicate()
-            debug_log(f"Websockify failed to start. STDOUT: {stdout}")
-            debug_log(f"Websockify failed to start. STDERR: {stderr}")
+class DBWriter:
+    """Write-behind writer owning one long-lived SQLite connection.
+
+    Producers queue (sql, rows) items; a background thread drains the queue in
+    order and applies them with executemany inside group commits, so callers
+    never wait for disk. A full queue blocks producers for up to
+    DB_ENQUEUE_TIMEOUT seconds before the write is dropped and counted.
+    """
+
+    def __init__(self, path, queue_size=DB_WRITE_QUEUE_SIZE,
+                 flush_interval=DB_FLUSH_INTERVAL, batch_size=DB_BATCH_SIZE, functions=()):
+        self.path = path
+        self.functions = functions  # (name, arg count, callable) SQL functions for queued statements
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.thread = None
+        self.dropped = 0
+        self.last_commit = 0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='db-writer', daemon=True)
+            self.thread.start()
+
+    def submit(self, sql, rows):
+        """Queue one statement with a list of parameter tuples"""
+        try:
+            self.queue.put((sql, rows, None), timeout=DB_ENQUEUE_TIMEOUT)
+            return True
+        except queue.Full:
+            self.dropped += len(rows)
+            debug_log(f"❌ DB write queue full, dropped {len(rows)} row(s)")
             return False
-        
-        debug_log(f"✅ Websockify started successfully on port {WEBSOCKIFY_PORT}")
-        return True
-        
-    except Exception as e:
-        debug_log(f"❌ Error starting websockify: {e}")
-        return False
 
-def monitor_websockify_heartbeat():
-    """Monitor websockify process heartbeat"""
-    global websockify_last_heartbeat
-    
-    while True:
-        if websockify_process and websockify_process.poll() is None:
-            websockify_last_heartbeat = time.time()
-        time.sleep(30)
+    def run_task(self, task):
+        """Queue task(conn) to run on the writer connection, in order with writes"""
+        self.queue.put((task, None, None))
 
-def stop_websockify():
-    """Stop websockify process"""
-    global websockify_process
-    
-    if websockify_process:
+    def flush(self, timeout=None):
+        """Block until everything queued so far is committed"""
+        if self.thread is None or not self.thread.is_alive():
+            return False
+        done = threading.Event()
+        self.queue.put((None, None, done))
+        return done.wait(timeout)
+
+    def stop(self, timeout=10):
+        """Flush pending writes and stop the writer thread"""
+        if self.thread is None:
+            return
+        self.flush(timeout)
+        self.queue.put((None, 'stop', None))
+        self.thread.join(timeout)
+        self.thread = None
+
+    def run(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        # Safe with WAL: a crash may lose the last commits but never corrupts
+        conn.execute('PRAGMA synchronous=NORMAL')
+        for name, arg_count, function in self.functions:
+            conn.create_function(name, arg_count, function, deterministic=True)
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            # Gather a group commit until batch is full, interval passes or a marker arrives
+            while len(batch) < self.batch_size and batch[-1][0] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.write_batch(conn, batch)
+            for sql, rows, done in batch:
+                if done is not None:
+                    done.set()
+                if sql is None and rows == 'stop':
+                    conn.close()
+                    return
+
+    def write_batch(self, conn, batch):
+        # Merge adjacent items with the same statement into one executemany
+        groups = []
+        for sql, rows, _ in batch:
+            if callable(sql):
+                # Tasks run between group commits, outside any transaction
+                self.commit_groups(conn, groups)
+                groups = []
+                try:
+                    sql(conn)
+                except sqlite3.Error as e:
+                    debug_log(f"❌ DB writer task failed: {e}")
+            elif sql is not None:
+                if groups and groups[-1][0] == sql:
+                    groups[-1][1].extend(rows)
+                else:
+                    groups.append((sql, list(rows)))
+        self.commit_groups(conn, groups)
+
+    def commit_groups(self, conn, groups):
+        if not groups:
+            return
         try:
-            websockify_process.terminate()
-            websockify_process.wait(timeout=5)
-            debug_log("Websockify stopped successfully")
-        except subprocess.TimeoutExpired:
-            websockify_process.kill()
-            websockify_process.wait()
-            debug_log("Websockify killed")
-        except Exception as e:
-            debug_log(f"Error stopping websockify: {e}")
-        finally:
-            websockify_process = None
+            with conn:
+                for sql, rows in groups:
+                    conn.executemany(sql, rows)
+            self.last_commit = time.time()
+        except sqlite3.Error as e:
+            debug_log(f"❌ Group commit failed, retrying row by row: {e}")
+            for sql, rows in groups:
+                for row in rows:
+                    try:
+                        with conn:
+                            conn.execute(sql, row)
+                    except sqlite3.Error as row_error:
+                        self.dropped += 1
+                        debug_log(f"❌ Error writing row to DB: {row_error}")
+            self.last_commit = time.time()
+
+def add_duration_buckets(counts, more):
+    """SQL function: element-wise sum of two comma-separated bucket count lists"""
+    return ','.join(str(int(a) + int(b)) for a, b in zip(counts.split(','), more.split(',')))
+
+db_writer = DBWriter(DB_PATH, functions=[('add_duration_buckets', 2, add_duration_buckets)])
+db_writer.start()
+
+Gauge('uvnc_db_write_queue_depth', 'Statements waiting for the DB writer', lambda: db_writer.queue.qsize())
+Gauge('uvnc_db_dropped_rows', 'Rows the DB writer dropped (queue full or write error)', lambda: db_writer.dropped)
+Gauge('uvnc_authorized_sessions', 'Sessions waiting to be used', lambda: session_registry.authorized_count)
+Gauge('uvnc_dashboard_connections', 'Connections shown on the dashboard', lambda: session_registry.dashboard_count)
+Gauge('uvnc_active_sessions', 'Repeater sessions by connection code', lambda: session_registry.active_count)
+
+# Events are stored in one table per day or month (see EVENT_PARTITION),
+# listed in event_partitions with their [start_ts, end_ts) range
+EVENT_PARTITION_DDL = (
+    '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY,
+        event_type TEXT,
+        timestamp INTEGER,
+        repeater_pid INTEGER,
+        viewer_ip TEXT,
+        server_ip TEXT,
+        connection_code INTEGER,
+        mode INTEGER,
+        viewer_table_index INTEGER,
+        server_table_index INTEGER,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_{name}_timestamp ON {name} (timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_{name}_type_timestamp ON {name} (event_type, timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_{name}_connection_code ON {name} (connection_code, timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_{name}_viewer_ip ON {name} (viewer_ip, timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_{name}_server_ip ON {name} (server_ip, timestamp)',
+)
+
+def load_event_partitions():
+    """Load partition catalog: name -> (start_ts, end_ts)"""
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute('SELECT name, start_ts, end_ts FROM event_partitions').fetchall()
+    conn.close()
+    return {name: (start_ts, end_ts) for name, start_ts, end_ts in rows}
+
+event_partitions_lock = threading.Lock()
+event_partitions = load_event_partitions()
+
+def partition_for(timestamp):
+    """Partition name and [start, end) range holding an event timestamp (UTC)"""
+    t = time.gmtime(timestamp)
+    if EVENT_PARTITION == 'day':
+        start = calendar.timegm((t.tm_year, t.tm_mon, t.tm_mday, 0, 0, 0))
+        return f"events_{t.tm_year:04d}{t.tm_mon:02d}{t.tm_mday:02d}", start, start + 86400
+    year, month = (t.tm_year + 1, 1) if t.tm_mon == 12 else (t.tm_year, t.tm_mon + 1)
+    return (f"events_{t.tm_year:04d}{t.tm_mon:02d}",
+            calendar.timegm((t.tm_year, t.tm_mon, 1, 0, 0, 0)),
+            calendar.timegm((year, month, 1, 0, 0, 0)))
+
+def ensure_event_partition(timestamp):
+    """Return the partition table for timestamp, creating it through the writer if new"""
+    name, start, end = partition_for(timestamp)
+    if name not in event_partitions:
+        with event_partitions_lock:
+            if name not in event_partitions:
+                def create_partition(conn):
+                    with conn:
+                        for statement in EVENT_PARTITION_DDL:
+                            conn.execute(statement.format(name=name))
+                        conn.execute('''
+                            INSERT OR IGNORE INTO event_partitions (name, start_ts, end_ts)
+                            VALUES (?, ?, ?)
+                        ''', (name, start, end))
+                db_writer.run_task(create_partition)
+                event_partitions[name] = (start, end)
+                debug_log(f"🗂️ New event partition {name}")
+    return name
+
+def partitions_overlapping(since=None, until=None):
+    """Partition names overlapping [since, until), newest range first"""
+    with event_partitions_lock:
+        partitions = list(event_partitions.items())
+    partitions.sort(key=lambda item: item[1][1], reverse=True)
+    return [(name, start, end) for name, (start, end) in partitions
+            if (since is None or end > since) and (until is None or start < until)]
+
+def query_partition(conn, sql, params):
+    """Run a query on one partition; a table the writer has not created yet is empty"""
+    try:
+        return conn.execute(sql, params).fetchall()
+    except sqlite3.OperationalError as e:
+        if 'no such table' in str(e):
+            return []
+        raise
+
+def load_last_event_id():
+    """Highest event id allocated so far"""
+    conn = sqlite3.connect(DB_PATH)
+    last_id = 0
+    for name, _, _ in partitions_overlapping():
+        rows = query_partition(conn, f'SELECT MAX(id) FROM {name}', ())
+        if rows:
+            last_id = max(last_id, rows[0][0] or 0)
+    seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+    conn.close()
+    return max(last_id, seq[0] if seq else 0)
+
+def load_last_row_id(table):
+    """Highest id allocated so far in a non-partitioned table"""
+    conn = sqlite3.connect(DB_PATH)
+    last_id = conn.execute(f'SELECT MAX(id) FROM {table}').fetchone()[0] or 0
+    seq = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+    conn.close()
+    return max(last_id, seq[0] if seq else 0)
+
+# Event ids are allocated here, not by SQLite, so rows are addressable by id
+# before the write-behind writer commits them. The state backend hands out
+# the ids, so worker processes sharing the database never reuse one.
+last_event_id = load_last_event_id()
+# device_auth and dashboard_removals ids likewise, so a state snapshot can
+# name the last row it covers
+last_auth_id = load_last_row_id('device_auth')
+last_removal_id = load_last_row_id('dashboard_removals')
+event_ids_lock = threading.Lock()
+
+# Recent non-heartbeat event rows (id, timestamp, API row) for the tail API
+RECENT_EVENT_ROWS = 1000
+recent_event_rows = deque(maxlen=RECENT_EVENT_ROWS)
+# Ring holds every non-heartbeat row with id above this floor
+recent_event_rows_floor = last_event_id
+
+class VncProxyWorker:
+    """One vncproxy.py process, restarted by its supervisor thread when it exits or hangs"""
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.process = None
+        self.control = None
+        self.send_lock = threading.Lock()
+        self.ready = False
+        self.restarts = 0
+        self.last_seen = 0
+        self.health = {}
+        self.viewers = {}  # session_id -> [browser ip]
+        self.traffic = {}  # session_id -> latest traffic report
+        self.thread = threading.Thread(target=self.supervise, name=f'vnc-proxy-{index}', daemon=True)
+
+    def spawn(self):
+        control, child = socket.socketpair()
+        self.process = subprocess.Popen([
+            sys.executable, VNC_PROXY_SCRIPT,
+            '--index', str(self.index),
+            '--port', str(VNC_PROXY_PORT),
+            '--repeater-host', VNC_REPEATER_HOST,
+            '--repeater-port', str(VNC_REPEATER_PORT),
+            '--control-fd', str(child.fileno())
+        ] + (['--debug'] if debug_on else []), pass_fds=(child.fileno(),))
+        child.close()
+        control.settimeout(VNC_PROXY_HEALTH_TIMEOUT)
+        return control
+
+    def supervise(self):
+        delay = VNC_PROXY_RESTART_DELAY
+        while not self.pool.stopping:
+            started = time.time()
+            control = self.spawn()
+            with self.send_lock:
+                self.control = control
+            try:
+                for line in control.makefile('rb'):
+                    self.handle(json.loads(line))
+            except socket.timeout:
+                debug_log(f"⚠️ VNC proxy worker {self.index} stopped reporting, killing it")
+                self.process.kill()
+            except (OSError, ValueError) as e:
+                debug_log(f"❌ VNC proxy worker {self.index} control error: {e}")
+                self.process.kill()
+            with self.send_lock:
+                self.control = None
+            control.close()
+            returncode = self.process.wait()
+            self.ready = False
+            self.viewers = {}
+            self.traffic = {}
+            if self.pool.stopping:
+                break
+            self.restarts += 1
+            uptime = time.time() - started
+            delay = VNC_PROXY_RESTART_DELAY if uptime > VNC_PROXY_STABLE_UPTIME else min(delay * 2, VNC_PROXY_MAX_RESTART_DELAY)
+            debug_log(f"⚠️ VNC proxy worker {self.index} exited ({returncode}), restarting in {delay}s")
+            publish_service_status()
+            time.sleep(delay)
+
+    def handle(self, message):
+        self.last_seen = time.time()
+        if 'ready' in message:
+            with self.pool.lock:
+                self.send({'routes': self.pool.routes})
+            self.ready = True
+            self.pool.ready.set()
+            debug_log(f"✅ VNC proxy worker {self.index} ready (pid {message['ready']})")
+            publish_service_status()
+        elif 'health' in message:
+            changed = message['health'] != self.health
+            self.health = message['health']
+            if changed:
+                publish_service_status()
+        elif 'traffic' in message:
+            self.traffic = {int(session_id): report for session_id, report in message['traffic'].items()}
+            self.pool.publish_traffic()
+        elif 'viewer' in message:
+            session_id, peer_ip, opened = message['viewer']
+            ips = self.viewers.setdefault(session_id, [])
+            if opened:
+                ips.append(peer_ip)
+            elif peer_ip in ips:
+                ips.remove(peer_ip)
+                if not ips:
+                    del self.viewers[session_id]
+
+    def send(self, message):
+        with self.send_lock:
+            if self.control is not None:
+                try:
+                    self.control.sendall(json.dumps(message).encode() + b'\n')
+                except OSError:
+                    pass  # worker is going away, it gets full routes after restart
+
+    def status(self):
+        return {
+            'index': self.index,
+            'pid': self.process.pid if self.process else None,
+            'alive': self.ready and time.time() - self.last_seen < VNC_PROXY_HEALTH_TIMEOUT,
+            'restarts': self.restarts,
+            'connections': self.health.get('connections', 0)
+        }
+
+class VncProxyPool:
+    """Supervised vncproxy.py workers and the session routes pushed to them"""
+
+    def __init__(self, size):
+        self.workers = [VncProxyWorker(self, index) for index in range(size)]
+        self.routes = {}  # session_id -> repeater connection code
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.stopping = False
+        self.last_traffic_publish = 0
+
+    def start(self, timeout=10):
+        for worker in self.workers:
+            worker.thread.start()
+        if not self.ready.wait(timeout):
+            raise OSError(f"no VNC proxy worker listening on port {VNC_PROXY_PORT}")
+
+    def update_routes(self, snapshot):
+        """State engine snapshot listener: send route changes to every worker"""
+        # Until the server side is linked the device registers under its session id
+        routes = {session_id: connection['connection_code'] or session_id
+                  for session_id, connection in snapshot.items()}
+        with self.lock:
+            message = {}
+            added = {session_id: code for session_id, code in routes.items()
+                     if self.routes.get(session_id) != code}
+            if added:
+                message['route'] = added
+            removed = [session_id for session_id in self.routes if session_id not in routes]
+            if removed:
+                message['unroute'] = removed
+            self.routes = routes
+            if message:
+                for worker in self.workers:
+                    worker.send(message)
+
+    def is_serving(self):
+        return any(worker.status()['alive'] for worker in self.workers)
+
+    def viewer_ips(self, session_id):
+        return [ip for worker in self.workers for ip in worker.viewers.get(session_id, ())]
+
+    def session_traffic(self):
+        """Traffic per session, summed over workers (RTT: the worst viewer)"""
+        merged = {}
+        for worker in self.workers:
+            for session_id, report in list(worker.traffic.items()):
+                total = merged.get(session_id)
+                if total is None:
+                    merged[session_id] = dict(report)
+                    continue
+                for name, value in report.items():
+                    if name.startswith('rtt'):
+                        total[name] = max(filter(None, (total[name], value)), default=None)
+                    else:
+                        total[name] += value
+        return merged
+
+    def publish_traffic(self):
+        """Send traffic to dashboard streams at most once per VNC_TRAFFIC_PUBLISH_INTERVAL"""
+        now = time.time()
+        if now - self.last_traffic_publish >= VNC_TRAFFIC_PUBLISH_INTERVAL:
+            self.last_traffic_publish = now
+            publish_dashboard_event('traffic', self.session_traffic())
+
+    def status(self):
+        return [worker.status() for worker in self.workers]
+
+    def stop(self):
+        self.stopping = True
+        for worker in self.workers:
+            if worker.process and worker.process.poll() is None:
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process:
+                try:
+                    worker.process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    worker.process.kill()
+
+def session_traffic_samples(*fields):
+    """LabeledGauge callback over the VNC proxy's per-session traffic"""
+    traffic = vnc_proxy.session_traffic() if vnc_proxy else {}
+    for session_id, report in traffic.items():
+        for field, labels, scale in fields:
+            if report[field] is not None:
+                yield (str(session_id), *labels), report[field] * scale
+
+LabeledGauge('uvnc_session_bytes', 'Bytes proxied per VNC session', ('session_id', 'direction'),
+             lambda: session_traffic_samples(('bytes_in', ('in',), 1), ('bytes_out', ('out',), 1)))
+LabeledGauge('uvnc_session_messages', 'WebSocket messages proxied per VNC session', ('session_id', 'direction'),
+             lambda: session_traffic_samples(('messages_in', ('in',), 1), ('messages_out', ('out',), 1)))
+LabeledGauge('uvnc_session_throughput_bytes_per_second', 'Rolling VNC session throughput',
+             ('session_id', 'direction', 'window'),
+             lambda: session_traffic_samples(*[(f'rate_{direction}_{window}', (direction, window), 1)
+                                               for direction in ('in', 'out') for window in ('1s', '10s', '60s')]))
+LabeledGauge('uvnc_session_rtt_seconds', 'Last WebSocket ping RTT to the viewer browser', ('session_id',),
+             lambda: session_traffic_samples(('rtt_ms', (), 0.001)))
+
+def start_vnc_proxy():
+    """Start the supervised pool of VNC proxy workers"""
+    global vnc_proxy
+    ok, detail = probe_repeater_process()
+    if not ok:
+        debug_log(f"Warning: UltraVNC repeater: {detail}")
+    vnc_proxy = VncProxyPool(VNC_PROXY_WORKERS)
+    vnc_proxy.update_routes(state_engine.snapshot)
+    state_engine.snapshot_listeners.append(vnc_proxy.update_routes)
+    vnc_proxy.start()
+    debug_log(f"✅ VNC proxy started on port {VNC_PROXY_PORT} with {VNC_PROXY_WORKERS} worker(s)")
+    return vnc_proxy
+
+# Admission limits for the HTTP API: token buckets per (client, route class),
+# so one device looping on take_slot cannot starve event ingestion. Events
+# from the repeater's own addresses are never limited or shed.
+RATE_LIMIT_ENABLED = os.environ.get('UVNC_RATE_LIMIT', '1') != '0'
+REPEATER_ADDRESSES = set(os.environ.get('UVNC_REPEATER_ADDRESSES', '127.0.0.1,::1').split(','))
+RATE_LIMITS = {  # route class -> (requests per second, burst)
+    'event': (50, 200),
+    'slot': (5, 50),
+    'api': (20, 100),
+}
+RATE_LIMIT_MAX_BUCKETS = 100000  # idle buckets are pruned beyond this
+SHED_QUEUE_LATENCY = 0.5  # seconds state commands may wait before requests are shed
+
+class RateLimiter:
+    """Token buckets keyed by (client, route class)"""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.buckets = {}  # (client, route class) -> [tokens, updated]
+        self.lock = threading.Lock()
+
+    def acquire(self, client, route_class):
+        """Take a token; returns 0 when allowed, else seconds until one is available"""
+        rate, burst = self.limits[route_class]
+        key = (client, route_class)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= RATE_LIMIT_MAX_BUCKETS:
+                    self.prune(now)
+                bucket = self.buckets[key] = [burst, now]
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                return (1 - tokens) / rate
+            bucket[0] = tokens - 1
+            return 0
+
+    def prune(self, now):
+        """Drop buckets idle long enough to have refilled; they start full anyway"""
+        for key, (tokens, updated) in list(self.buckets.items()):
+            rate, burst = self.limits[key[1]]
+            if tokens + (now - updated) * rate >= burst:
+                del self.buckets[key]
+
+rate_limiter = RateLimiter(RATE_LIMITS)
+RATE_LIMITED_TOTAL = Counter('uvnc_http_rate_limited_total', 'Requests refused with 429 by the rate limiter', 'route_class')
+SHED_TOTAL = Counter('uvnc_http_shed_total', 'Requests refused with 503 while the state engine lags', 'route_class')
+Gauge('uvnc_state_queue_latency_seconds', 'Wait of the oldest command in the last state engine batch',
+      lambda: state_engine.queue_latency)
+
+def request_route_class():
+    """Rate limit class of the current request, None for pages and static files"""
+    if request.endpoint == 'handle_event' or (request.endpoint == 'handle_root' and request.args):
+        return 'event'
+    if request.endpoint in ('take_slot', 'take_slots'):
+        return 'slot'
+    if request.path.startswith('/api/'):
+        return 'api'
+    return None
+
+def limit_response(status, retry_after, message):
+    response = jsonify({'error': message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+@app.before_request
+def admit_request():
+    """Shed load while the state engine lags, then apply the client's token bucket"""
+    route_class = request_route_class() if RATE_LIMIT_ENABLED else None
+    if route_class is None:
+        return None
+    client = request.remote_addr
+    if route_class == 'event' and client in REPEATER_ADDRESSES:
+        return None
+    if state_engine.queue_latency > SHED_QUEUE_LATENCY:
+        SHED_TOTAL.inc(route_class)
+        return limit_response(503, STATE_SYNC_INTERVAL, 'Server overloaded')
+    retry_after = rate_limiter.acquire(client, route_class)
+    if retry_after:
+        RATE_LIMITED_TOTAL.inc(route_class)
+        debug_log(f"🚦 Rate limited {client} on {route_class}")
+        return limit_response(429, retry_after, 'Too many requests')
+    return None
 
 @app.route('/', methods=['GET'])
 def handle_root():
@@ -199,10 +1469,9 @@ def events_page():
 
 # API endpoints
 @app.route('/api/event', methods=['GET', 'POST'])
+@timed(HANDLE_EVENT_SECONDS)
 def handle_event():
     """Handle incoming events from repeater"""
-    global repeater_last_heartbeat
-    
     if request.method == 'GET':
         data = request.args
         debug_log(f"🔔 RAW GET EVENT: {dict(data)}")
@@ -211,25 +1480,17 @@ def handle_event():
         debug_log(f"🔔 RAW POST EVENT: {dict(data)}")
     
     try:
+        trace_event(data)
         event_data = parse_event_data(data)
         debug_log(f"📋 PARSED EVENT: {event_data}")
         
-        # Update repeater heartbeat
-        if event_data['event_type'] == 'REPEATER_HEARTBEAT':
-            repeater_last_heartbeat = time.time()
-            debug_log("❤️ Repeater heartbeat received")
-        
-        # Сохраняем событие
-        store_event(event_data)
-        debug_log(f"💾 Event stored in database")
-        
-        # Обрабатываем событие
-        process_event(event_data)
+        # Сохраняем и обрабатываем событие
+        state_engine.call(process_event_batch, [event_data])
         
         # Выводим текущее состояние после обработки
         debug_log(f"📊 AFTER PROCESSING:")
-        debug_log(f"   Active sessions: {len(active_sessions)}")
-        debug_log(f"   Dashboard connections: {len(dashboard_connections)}")
+        debug_log(f"   Active sessions: {session_registry.active_count}")
+        debug_log(f"   Dashboard connections: {session_registry.dashboard_count}")
         
         return jsonify({'status': 'success', 'message': 'Event processed'})
     
@@ -239,67 +1500,237 @@ def handle_event():
         traceback.print_exc()
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
+# Live event capture for scripts/event_replay.py: one JSON line per raw event
+EVENT_TRACE_PATH = os.environ.get('UVNC_EVENT_TRACE', '')
+event_trace_file = open(EVENT_TRACE_PATH, 'a', buffering=1) if EVENT_TRACE_PATH else None
+event_trace_lock = threading.Lock()
+
+def trace_event(raw):
+    """Append raw repeater parameters to the trace file, if capture is on"""
+    if event_trace_file is None:
+        return
+    line = json.dumps({'t': time.time(), 'event': dict(raw)}) + '\n'
+    with event_trace_lock:
+        event_trace_file.write(line)
+
+# Repeater event numbers (EvNum) -> event type, see repeaterevents.cpp
+EVENT_TYPES = (
+    'VIEWER_CONNECT',               # 0
+    'VIEWER_DISCONNECT',            # 1
+    'SERVER_CONNECT',               # 2
+    'SERVER_DISCONNECT',            # 3
+    'VIEWER_SERVER_SESSION_START',  # 4
+    'VIEWER_SERVER_SESSION_END',    # 5
+    'REPEATER_STARTUP',             # 6
+    'REPEATER_SHUTDOWN',            # 7
+    'REPEATER_HEARTBEAT'            # 8
+)
+EVENT_TYPE_BY_NUM = {str(num): name for num, name in enumerate(EVENT_TYPES)}
+
+# Parsed IP field <- raw parameter, per event type
+EVENT_IP_FIELDS = {
+    'VIEWER_CONNECT': (('viewer_ip', 'Ip'),),
+    'VIEWER_DISCONNECT': (('viewer_ip', 'Ip'),),
+    'SERVER_CONNECT': (('server_ip', 'Ip'),),
+    'SERVER_DISCONNECT': (('server_ip', 'Ip'),),
+    'VIEWER_SERVER_SESSION_START': (('viewer_ip', 'VwrIp'), ('server_ip', 'SvrIp')),
+    'VIEWER_SERVER_SESSION_END': (('viewer_ip', 'VwrIp'), ('server_ip', 'SvrIp')),
+}
+
+# Parsed integer field <- first non-empty raw parameter, with default
+EVENT_INT_FIELDS = (
+    ('repeater_pid', ('Pid',), 0),
+    ('connection_code', ('Code',), 0),
+    ('mode', ('Mode',), 0),
+    ('viewer_table_index', ('VwrTblInd', 'TblInd'), -1),
+    ('server_table_index', ('SvrTblInd',), -1),
+    ('max_sessions', ('MaxSessions',), 0),
+)
+
+@timed(PARSE_SECONDS)
 def parse_event_data(data):
     """Parse event data from different formats"""
-    event_types = {
-        '0': 'VIEWER_CONNECT',      # 0
-        '1': 'VIEWER_DISCONNECT',   # 1
-        '2': 'SERVER_CONNECT',      # 2
-        '3': 'SERVER_DISCONNECT',   # 3
-        '4': 'VIEWER_SERVER_SESSION_START',  # 4
-        '5': 'VIEWER_SERVER_SESSION_END',    # 5
-        '6': 'REPEATER_STARTUP',    # 6
-        '7': 'REPEATER_SHUTDOWN',   # 7
-        '8': 'REPEATER_HEARTBEAT'   # 8
-    }
-    
-    event_num = data.get('EvNum', '0')
-    event_type = event_types.get(event_num, 'UNKNOWN')
-    
-    debug_log(f"🔍 Parsing event: EvNum={event_num}, type={event_type}")
-    
-    # Инициализируем переменные
-    viewer_ip = ''
-    server_ip = ''
-    connection_code = int(data.get('Code', 0))
-    
-    if event_type == 'VIEWER_CONNECT':
-        viewer_ip = format_ip(data.get('Ip'))
-        debug_log(f"   Viewer IP from 'Ip' parameter: {viewer_ip}")
-        
-    elif event_type == 'SERVER_CONNECT':
-        server_ip = format_ip(data.get('Ip'))
-        debug_log(f"   Server IP from 'Ip' parameter: {server_ip}")
-        
-    elif event_type in ['VIEWER_SERVER_SESSION_START', 'VIEWER_SERVER_SESSION_END']:
-        viewer_ip = format_ip(data.get('VwrIp'))
-        server_ip = format_ip(data.get('SvrIp'))
-        debug_log(f"   Session IPs - Viewer: {viewer_ip}, Server: {server_ip}")
-        
-    elif event_type in ['VIEWER_DISCONNECT', 'SERVER_DISCONNECT']:
-        if event_type == 'VIEWER_DISCONNECT':
-            viewer_ip = format_ip(data.get('Ip'))
-            debug_log(f"   Viewer disconnect IP from 'Ip': {viewer_ip}")
-        else:
-            server_ip = format_ip(data.get('Ip'))
-            debug_log(f"   Server disconnect IP from 'Ip': {server_ip}")
-    
+    event_type = EVENT_TYPE_BY_NUM.get(str(data.get('EvNum', '0')), 'UNKNOWN')
     parsed_data = {
         'event_type': event_type,
-        'timestamp': int(data.get('Time', time.time())),
-        'repeater_pid': int(data.get('Pid', 0)),
-        'viewer_ip': viewer_ip,
-        'server_ip': server_ip,
-        'connection_code': connection_code,
-        'mode': int(data.get('Mode', 0)),
-        'viewer_table_index': int(data.get('VwrTblInd') or data.get('TblInd', -1)),
-        'server_table_index': int(data.get('SvrTblInd', -1)),
-        'max_sessions': int(data.get('MaxSessions', 0))
+        'timestamp': int(data.get('Time') or time.time()),
+        'viewer_ip': '',
+        'server_ip': ''
     }
-    
-    debug_log(f"   Final parsed data: {parsed_data}")
+    for field, raw_field in EVENT_IP_FIELDS.get(event_type, ()):
+        parsed_data[field] = format_ip(data.get(raw_field))
+    for field, raw_fields, default in EVENT_INT_FIELDS:
+        raw = None
+        for raw_field in raw_fields:
+            raw = data.get(raw_field)
+            if raw:
+                break
+        parsed_data[field] = int(raw) if raw not in (None, '') else default
+    if debug_on:
+        debug_log(f"🔍 Parsed event: {parsed_data}")
     return parsed_data
 
+def parse_event_line(line):
+    """Split one line of the repeater event stream into raw parameters.
+
+    Accepts both repeater formats:
+      EvMsgVer:1,EvNum:2,Time:...,Ip:1.2.3.4
+      GET /?EvMsgVer=1&EvNum=2&Time=...&Ip=1.2.3.4 HTTP/1.0
+    Returns None for anything else (blank lines, HTTP headers).
+    """
+    if line.startswith('GET '):
+        _, _, query = line[4:].split(' ', 1)[0].partition('?')
+        if not query:
+            return None
+        return dict(pair.partition('=')[::2] for pair in query.split('&') if pair)
+    if line.startswith('EvMsgVer:'):
+        return dict(pair.partition(':')[::2] for pair in line.split(','))
+    return None
+
+def process_event_batch(events):
+    """Store and process a batch of parsed events as one unit.
+
+    Heartbeats take a fast path: they only update repeater liveness and are
+    not stored as event rows.
+    """
+    global repeater_last_heartbeat
+    heartbeat = False
+    for event_data in events:
+        EVENTS_TOTAL.inc(event_data['event_type'])
+        if event_data['event_type'] in LIVENESS_EVENT_TYPES:
+            record_liveness(event_data)
+            if event_data['event_type'] == 'REPEATER_HEARTBEAT':
+                heartbeat = True
+    if heartbeat:
+        repeater_last_heartbeat = time.time()
+        schedule_heartbeat_expiry()
+        events = [event_data for event_data in events if event_data['event_type'] != 'REPEATER_HEARTBEAT']
+    if events:
+        store_events(events)
+        for event_data in events:
+            process_event(event_data)
+    if slot_waiters:
+        admit_slot_waiters()
+    if heartbeat:
+        publish_service_status()
+
+# Repeater liveness, coalesced from heartbeats
+LIVENESS_EVENT_TYPES = ('REPEATER_HEARTBEAT', 'REPEATER_STARTUP')
+liveness_lock = threading.Lock()
+
+def load_repeater_liveness():
+    """Load liveness rows: pid -> [first_seen, last_seen, heartbeat_count, max_sessions]"""
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute('''
+        SELECT repeater_pid, first_seen, last_seen, heartbeat_count, max_sessions
+        FROM repeater_liveness
+    ''').fetchall()
+    conn.close()
+    return {row[0]: list(row[1:]) for row in rows}
+
+repeater_liveness = load_repeater_liveness()
+
+def repeater_max_sessions():
+    """MaxSessions of the repeater heard from last, 0 until one reports it.
+
+    Kept in the state backend: with shared state only the worker running the
+    event listener hears the repeater, and every worker admits slots by it.
+    """
+    return session_registry.get_value('repeater_max_sessions', 0)
+
+if session_registry.get_value('repeater_max_sessions') is None:
+    session_registry.set_value('repeater_max_sessions', max(repeater_liveness.values(), key=lambda row: row[1],
+                                                            default=[0] * 4)[3])
+# Newest liveness signal from any repeater, for outage (gap) detection
+liveness_last_seen = max((row[1] for row in repeater_liveness.values()), default=0)
+
+def record_liveness(event_data):
+    """Fold a heartbeat/startup into its repeater's liveness row, recording gaps as outages"""
+    global liveness_last_seen
+    pid = event_data['repeater_pid']
+    timestamp = event_data['timestamp']
+    max_sessions = event_data['max_sessions']
+    with liveness_lock:
+        if liveness_last_seen and timestamp - liveness_last_seen > HEARTBEAT_TIMEOUT:
+            db_writer.submit('''
+                INSERT INTO repeater_outages (repeater_pid, started_at, ended_at, duration)
+                VALUES (?, ?, ?, ?)
+            ''', [(pid, liveness_last_seen, timestamp, timestamp - liveness_last_seen)])
+            debug_log(f"⚠️ Repeater outage recorded: {timestamp - liveness_last_seen}s without heartbeat")
+        liveness_last_seen = max(liveness_last_seen, timestamp)
+        row = repeater_liveness.get(pid)
+        if row is None:
+            row = repeater_liveness[pid] = [timestamp, timestamp, 0, max_sessions]
+        row[1] = max(row[1], timestamp)
+        if event_data['event_type'] == 'REPEATER_HEARTBEAT':
+            row[2] += 1
+        if max_sessions:
+            row[3] = max_sessions
+            if max_sessions != repeater_max_sessions():
+                session_registry.set_value('repeater_max_sessions', max_sessions)
+        db_writer.submit('''
+            INSERT INTO repeater_liveness (repeater_pid, first_seen, last_seen, heartbeat_count, max_sessions)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(repeater_pid) DO UPDATE SET
+                last_seen = excluded.last_seen,
+                heartbeat_count = excluded.heartbeat_count,
+                max_sessions = excluded.max_sessions
+        ''', [(pid, *row)])
+
+class RepeaterEventProtocol(asyncio.Protocol):
+    """Line protocol for the repeater event stream.
+
+    The repeater writes its whole event FIFO over one TCP connection, so every
+    complete line received in a chunk is parsed and processed as one batch.
+    """
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.buffer = b''
+
+    def data_received(self, data):
+        lines = (self.buffer + data).split(b'\n')
+        self.buffer = lines.pop()
+        self.handle_lines(lines)
+
+    def eof_received(self):
+        if self.buffer:
+            self.handle_lines([self.buffer])
+            self.buffer = b''
+        return False
+
+    def handle_lines(self, lines):
+        events = []
+        for line in lines:
+            try:
+                raw = parse_event_line(line.decode('ascii', 'replace').strip())
+                if raw is not None:
+                    trace_event(raw)
+                    events.append(parse_event_data(raw))
+            except Exception as e:
+                debug_log(f"❌ Bad event line {line!r}: {e}")
+        if events:
+            # State engine applies batches in arrival order, off the event loop
+            state_engine.submit(process_event_batch, events).add_done_callback(log_event_batch_result)
+
+def log_event_batch_result(future):
+    if future.exception() is not None:
+        debug_log(f"❌ Error processing event batch: {future.exception()}")
+
+event_listener_server = None
+
+def start_event_listener():
+    """Start asyncio TCP listener for the repeater event stream in a background thread"""
+    global event_listener_server
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(
+        loop.create_server(RepeaterEventProtocol, EVENT_LISTENER_HOST, EVENT_LISTENER_PORT))
+    threading.Thread(target=loop.run_forever, name='event-listener', daemon=True).start()
+    debug_log(f"✅ Event listener started on {EVENT_LISTENER_HOST}:{EVENT_LISTENER_PORT}")
+    event_listener_server = server
+    return server
+
+@timed(PROCESS_SECONDS)
 def process_event(event_data):
     """Process event and update dashboard connections"""
     event_type = event_data['event_type']
@@ -307,6 +1738,8 @@ def process_event(event_data):
     server_ip = event_data['server_ip']
     viewer_ip = event_data['viewer_ip']
     debug_log(f"🔄 PROCESSING: {event_type}, code={connection_code}")
+    # Replayed events keep the time they happened, not the time of the restore
+    event_time = event_data['timestamp'] if replaying_events else time.time()
     # Add to recent events
     recent_events.append({
         'timestamp': datetime.fromtimestamp(event_data['timestamp']).strftime('%H:%M:%S'),
@@ -318,302 +1751,635 @@ def process_event(event_data):
     # Update dashboard connections based on event type
     if event_type == 'VIEWER_CONNECT':
         debug_log(f"   👁️ Viewer connected: {viewer_ip}")
-        update_viewer_connect(connection_code, viewer_ip)
+        update_viewer_connect(connection_code, viewer_ip, event_time)
     elif event_type == 'VIEWER_DISCONNECT':
         debug_log(f"   👁️ Viewer disconnected: {viewer_ip}")
-        update_viewer_disconnect(connection_code)
+        update_viewer_disconnect(connection_code, event_time)
     elif event_type == 'SERVER_CONNECT':
         debug_log(f"   🖥️ Server connected: {server_ip}")
-        # Ищем сессию по IP клиента и устанавливаем связь
-        debug_log(f"🔍 Looking for session with server_ip: {server_ip}")
-
-        # Ищем сессию по IP клиента
+        # Ищем ожидающую сессию по IP клиента и устанавливаем связь
         session_to_link = None
-        for session_id, session_data in authorized_sessions.items():
-            if session_data['client_ip'] == server_ip and session_data.get('connection_code') is None:
-                session_to_link = session_id
-                break
-
-        if session_to_link:
-            # Устанавливаем связь между connection_code и session_id
-            authorized_sessions[session_to_link]['connection_code'] = connection_code
-            connection_to_session_map[connection_code] = session_to_link
+        record = session_registry.find_pending(server_ip)
+        if record:
+            session_to_link = record.session_id
+            session_registry.update(record, connection_code=connection_code, mapped=True)
             debug_log(f"🔗 Linked session {session_to_link} with connection code {connection_code}")
 
             # Update dashboard connection
-            update_server_connect(session_to_link, connection_code, server_ip)
+            update_server_connect(session_to_link, connection_code, server_ip, event_time)
         # СОЗДАЕМ СЕССИЮ ПРИ ПОДКЛЮЧЕНИИ СЕРВЕРА
-        active_sessions[connection_code] = {
-            'server_ip': server_ip,
-            'viewer_ip': '',  # Пока нет клиента
-            'mode': event_data['mode'],
-            'start_time': event_data['timestamp'],
-            'server_index': event_data['server_table_index'],
-            'viewer_index': -1,
-            'status': 'waiting_for_viewer',
-            'session_id': session_to_link
-        }
+        session_registry.set_active(ActiveSession(
+            connection_code,
+            server_ip=server_ip,
+            mode=event_data['mode'],
+            start_time=event_data['timestamp'],
+            server_index=event_data['server_table_index'],
+            status='waiting_for_viewer',
+            session_id=session_to_link
+        ))
         debug_log(f"✅ SERVER SESSION CREATED: code={connection_code}, server={server_ip}, linked_session={session_to_link}")
     elif event_type == 'SERVER_DISCONNECT':
         debug_log(f"   🖥️ Server disconnected: {server_ip}")
 
         # Update dashboard connection
-        update_server_disconnect(connection_code)
-
-        # Удаляем из маппинга если есть
-        if connection_code in connection_to_session_map:
-            session_id = connection_to_session_map[connection_code]
-            if session_id in authorized_sessions:
-                authorized_sessions[session_id]['status'] = 'server_disconnected'
-            del connection_to_session_map[connection_code]
+        update_server_disconnect(connection_code, event_time)
+
+        # Удаляем связь если есть
+        record = session_registry.get_by_code(connection_code)
+        if record and record.mapped:
+            if record.authorized:
+                session_registry.update(record, mapped=False, status='server_disconnected')
+            else:
+                session_registry.update(record, mapped=False)
             debug_log(f"🔗 Removed session mapping for connection: {connection_code}")
 
         # Удаляем сессию при отключении сервера
-        if connection_code in active_sessions:
+        session = session_registry.pop_active(connection_code)
+        if session:
+            if session.status == 'active':
+                # Viewer was attached but no SESSION_END arrived
+                record_session_end(session, event_data['timestamp'], 'server_disconnect',
+                                   record.serial_id if record else '')
             debug_log(f"❌ SERVER SESSION REMOVED: code={connection_code}")
-            del active_sessions[connection_code]
         else:
             debug_log(f"⚠️ Server session not found for removal: {connection_code}")
     elif event_type == 'VIEWER_SERVER_SESSION_START':
         debug_log(f"   🔗 Session started: viewer={viewer_ip}, server={server_ip}")
 
         # ✅ УДАЛЯЕМ АВТОРИЗАЦИОННУЮ СЕССИЮ ПРИ ПОДКЛЮЧЕНИИ КЛИЕНТА
-        if connection_code in connection_to_session_map:
-            session_id_to_remove = connection_to_session_map[connection_code]
-            if remove_auth_session(session_id_to_remove):
-                del connection_to_session_map[connection_code]
-                debug_log(f"🔗 VNC client connected, removed auth session: {session_id_to_remove} for connection: {connection_code}")
+        record = session_registry.get_by_code(connection_code)
+        if record and record.mapped:
+            if remove_auth_session(record.session_id):
+                debug_log(f"🔗 VNC client connected, removed auth session: {record.session_id} for connection: {connection_code}")
         else:
             debug_log(f"⚠️ No session mapping found for connection code: {connection_code}")
 
         # Update dashboard connection with viewer info
-        update_viewer_connect(connection_code, viewer_ip)
+        update_viewer_connect(connection_code, viewer_ip, event_time)
 
         # Остальная логика обновления сессии...
-        if connection_code in active_sessions:
-            active_sessions[connection_code].update({
-                'viewer_ip': viewer_ip,
-                'viewer_index': event_data['viewer_table_index'],
-                'status': 'active'
-            })
+        if session_registry.get_active(connection_code):
+            session_registry.update_active(
+                connection_code,
+                viewer_ip=viewer_ip,
+                viewer_index=event_data['viewer_table_index'],
+                status='active'
+            )
             debug_log(f"🔗 SESSION UPDATED WITH VIEWER: code={connection_code}, viewer={viewer_ip}")
         else:
-            active_sessions[connection_code] = {
-                'viewer_ip': viewer_ip,
-                'server_ip': event_data['server_ip'],
-                'mode': event_data['mode'],
-                'start_time': event_data['timestamp'],
-                'viewer_index': event_data['viewer_table_index'],
-                'server_index': event_data['server_table_index'],
-                'status': 'active'
-            }
+            session_registry.set_active(ActiveSession(
+                connection_code,
+                viewer_ip=viewer_ip,
+                server_ip=event_data['server_ip'],
+                mode=event_data['mode'],
+                start_time=event_data['timestamp'],
+                viewer_index=event_data['viewer_table_index'],
+                server_index=event_data['server_table_index'],
+                status='active'
+            ))
             debug_log(f"⚠️ NEW SESSION CREATED (no server): code={connection_code}")
     elif event_type == 'VIEWER_SERVER_SESSION_END':
         debug_log(f"   🔗 Session ended: viewer={viewer_ip}, server={server_ip}")
+        record = session_registry.get_by_code(connection_code)
+        serial_id = record.serial_id if record else ''
         # Update dashboard connection
-        update_viewer_disconnect(connection_code)
+        update_viewer_disconnect(connection_code, event_time)
         # НЕМЕДЛЕННО УДАЛЯЕМ КАРТОЧКУ ПРИ ЗАВЕРШЕНИИ СЕССИИ
         remove_dashboard_connection_by_code(connection_code)
         # Сохраняем завершенную сессию
-        if connection_code in active_sessions:
-            session = active_sessions[connection_code]
-            duration = event_data['timestamp'] - session['start_time']
+        session = session_registry.pop_active(connection_code)
+        if session:
+            if not session.viewer_ip:
+                session.viewer_ip = viewer_ip
+            duration = record_session_end(session, event_data['timestamp'], 'session_end', serial_id)
             debug_log(f"📊 SESSION ENDED: code={connection_code}, duration={duration}s")
-            del active_sessions[connection_code]
         else:
             debug_log(f"⚠️ Session not found for ending: {connection_code}")
 
-def update_server_connect(session_id, connection_code, server_ip):
+# Upper bounds (seconds) of session duration histogram buckets, last is open-ended
+SESSION_DURATION_BUCKETS = (10, 30, 60, 300, 600, 1800, 3600, 7200, 14400, 28800, 86400, float('inf'))
+
+def record_session_end(session, end_ts, end_reason, serial_id=''):
+    """Write the finished session fact row and fold it into its hourly rollup"""
+    duration = max(0, end_ts - session.start_time)
+    if replaying_events:
+        # Written before the restart
+        return duration
+    db_writer.submit('''
+        INSERT INTO sessions
+        (connection_code, session_id, serial_id, server_ip, viewer_ip,
+         start_ts, end_ts, duration, end_reason)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(session.connection_code, session.session_id, serial_id, session.server_ip,
+           session.viewer_ip, session.start_time, end_ts, duration, end_reason)])
+    # The writer merges the session into its hourly rollup, so the engine never reads the DB
+    buckets = [0] * len(SESSION_DURATION_BUCKETS)
+    buckets[bisect.bisect_left(SESSION_DURATION_BUCKETS, duration)] = 1
+    db_writer.submit('''
+        INSERT INTO session_rollups
+        (hour_ts, server_ip, session_count, total_duration, max_duration, duration_buckets)
+        VALUES (?, ?, 1, ?, ?, ?)
+        ON CONFLICT (hour_ts, server_ip) DO UPDATE SET
+            session_count = session_count + 1,
+            total_duration = total_duration + excluded.total_duration,
+            max_duration = MAX(max_duration, excluded.max_duration),
+            duration_buckets = add_duration_buckets(duration_buckets, excluded.duration_buckets)
+    ''', [(end_ts - end_ts % 3600, session.server_ip, duration, duration, ','.join(map(str, buckets)))])
+    return duration
+
+def update_server_connect(session_id, connection_code, server_ip, at):
     """Update dashboard connection when server connects"""
     debug_log(f"🔄 Updating dashboard connection for session {session_id}")
-    if session_id in dashboard_connections:
-        dashboard_connections[session_id].update({
-            'server_connected': True,
-            'server_ip': server_ip,
-            'connection_code': connection_code,
-            'server_connect_time': time.time()
-        })
+    record = session_registry.get(session_id)
+    if record and record.on_dashboard:
+        session_registry.update(
+            record,
+            server_connected=True,
+            server_ip=server_ip,
+            connection_code=connection_code,
+            server_connect_time=at
+        )
         debug_log(f"📊 Dashboard updated: server connected for session {session_id}")
 
-def update_server_disconnect(connection_code):
+def update_server_disconnect(connection_code, at):
     """Update dashboard connection when server disconnects"""
-    # Find session_id by connection_code
-    session_id = None
-    for sess_id, conn_data in dashboard_connections.items():
-        if conn_data.get('connection_code') == connection_code:
-            session_id = sess_id
-            break
-    if session_id:
-        dashboard_connections[session_id].update({
-            'server_connected': False,
-            'server_ip': '',
-            'server_disconnect_time': time.time()
-        })
-        debug_log(f"📊 Dashboard updated: server disconnected for session {session_id}")
+    record = session_registry.get_by_code(connection_code)
+    if record and record.on_dashboard:
+        session_registry.update(
+            record,
+            server_connected=False,
+            server_ip='',
+            server_disconnect_time=at
+        )
+        debug_log(f"📊 Dashboard updated: server disconnected for session {record.session_id}")
     else:
         debug_log(f"❌ No session mapping found for server disconnect code: {connection_code}")
 
-def update_viewer_connect(connection_code, viewer_ip):
+def update_viewer_connect(connection_code, viewer_ip, at):
     """Update dashboard connection when viewer connects"""
-    # Find session_id by connection_code
-    session_id = None
-    for sess_id, conn_data in dashboard_connections.items():
-        if conn_data.get('connection_code') == connection_code:
-            session_id = sess_id
-            break
-    if session_id:
-        # Try to get real client IP from websockify
-        real_viewer_ip = get_real_viewer_ip(session_id, viewer_ip)
-        dashboard_connections[session_id].update({
-            'viewer_connected': True,
-            'viewer_ip': real_viewer_ip,
-            'viewer_connect_time': time.time()
-        })
-        debug_log(f"📊 Dashboard updated: viewer connected for session {session_id}")
+    record = session_registry.get_by_code(connection_code)
+    if record and record.on_dashboard:
+        # Try to get real client IP from the VNC proxy
+        real_viewer_ip = get_real_viewer_ip(record.session_id, viewer_ip)
+        session_registry.update(
+            record,
+            viewer_connected=True,
+            viewer_ip=real_viewer_ip,
+            viewer_connect_time=at
+        )
+        debug_log(f"📊 Dashboard updated: viewer connected for session {record.session_id}")
 
-def update_viewer_disconnect(connection_code):
+def update_viewer_disconnect(connection_code, at):
     """Update dashboard connection when viewer disconnects"""
-    # Find session_id by connection_code
-    session_id = None
-    for sess_id, conn_data in dashboard_connections.items():
-        if conn_data.get('connection_code') == connection_code:
-            session_id = sess_id
-            break
-    if session_id:
-        dashboard_connections[session_id].update({
-            'viewer_connected': False,
-            'viewer_ip': '',
-            'viewer_disconnect_time': time.time()
-        })
-        debug_log(f"📊 Dashboard updated: viewer disconnected for session {session_id}")
+    record = session_registry.get_by_code(connection_code)
+    if record and record.on_dashboard:
+        session_registry.update(
+            record,
+            viewer_connected=False,
+            viewer_ip='',
+            viewer_disconnect_time=at
+        )
+        debug_log(f"📊 Dashboard updated: viewer disconnected for session {record.session_id}")
     else:
         debug_log(f"❌ No session mapping found for viewer disconnect code: {connection_code}")
 
 def remove_dashboard_connection_by_code(connection_code):
     """Remove dashboard connection by connection code"""
     debug_log(f"🔄 Looking for dashboard connection to remove: code={connection_code}")
-    # Ищем session_id по connection_code
-    session_id_to_remove = None
-    # Сначала проверяем маппинг
-    if connection_code in connection_to_session_map:
-        session_id_to_remove = connection_to_session_map[connection_code]
-        debug_log(f"✅ Found session mapping for removal: {connection_code} -> {session_id_to_remove}")
-    else:
-        # Ищем в dashboard_connections по connection_code
-        for session_id, conn_data in dashboard_connections.items():
-            if conn_data.get('connection_code') == connection_code:
-                session_id_to_remove = session_id
-                debug_log(f"✅ Found connection in dashboard: {connection_code} -> {session_id_to_remove}")
-                break
-    if session_id_to_remove and session_id_to_remove in dashboard_connections:
-        del dashboard_connections[session_id_to_remove]
-        debug_log(f"🗑️ Removed dashboard connection: {session_id_to_remove} (code: {connection_code})")
-        # Также удаляем из authorized_sessions если есть
-        if session_id_to_remove in authorized_sessions:
-            del authorized_sessions[session_id_to_remove]
-            debug_log(f"🗑️ Removed auth session: {session_id_to_remove}")
+    record = session_registry.get_by_code(connection_code)
+    if record and record.on_dashboard:
+        # Также удаляем авторизацию если есть
+        session_registry.update(record, on_dashboard=False, authorized=False, mapped=False)
+        debug_log(f"🗑️ Removed dashboard connection: {record.session_id} (code: {connection_code})")
     else:
         debug_log(f"⚠️ No dashboard connection found for removal with code: {connection_code}")
 
 def get_real_viewer_ip(session_id, default_ip):
-    """Try to get real viewer IP from websockify"""
+    """Browser IP from the VNC proxy when the repeater sees the proxy as viewer"""
     if default_ip == '127.0.0.1':
-        return 'Connected via Websockify'
+        viewer_ips = vnc_proxy.viewer_ips(session_id) if vnc_proxy else []
+        return viewer_ips[-1] if viewer_ips else 'Connected via VNC proxy'
     return default_ip
 
 def format_ip(ip_data):
     """Format IP address from various input formats"""
     if not ip_data:
-        debug_log("   IP data is empty")
         return ''
     if isinstance(ip_data, str):
-        if '.' in ip_data:
-            debug_log(f"   IP is already formatted: {ip_data}")
-            return ip_data
-        elif ip_data.isdigit():
-            result = f"0.0.0.{ip_data}"
-            debug_log(f"   Converted numeric IP: {ip_data} -> {result}")
-            return result
-        debug_log(f"   IP is string but not numeric: {ip_data}")
+        if '.' not in ip_data and ip_data.isdigit():
+            return f"0.0.0.{ip_data}"
         return ip_data
-    debug_log(f"   IP data is not string: {type(ip_data)} - {ip_data}")
     return str(ip_data)
 
 def store_event(event_data):
     """Store event in database"""
-    try:
-        conn = sqlite3.connect('/tmp/repeater_events.db')
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO events 
-            (event_type, timestamp, repeater_pid, viewer_ip, server_ip, 
-             connection_code, mode, viewer_table_index, server_table_index)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            event_data['event_type'],
-            event_data['timestamp'],
-            event_data['repeater_pid'],
-            event_data['viewer_ip'],
-            event_data['server_ip'],
-            event_data['connection_code'],
-            event_data['mode'],
-            event_data['viewer_table_index'],
-            event_data['server_table_index']
-        ))
-        conn.commit()
-        conn.close()
-        debug_log(f"💾 Event stored in DB: {event_data['event_type']}")
-    except Exception as e:
-        debug_log(f"❌ Error storing event in DB: {e}")
+    store_events([event_data])
+
+@timed(STORE_SECONDS)
+def store_events(events):
+    """Assign event ids and queue a batch for the background DB writer"""
+    global recent_event_rows_floor
+    if not events:
+        return
+    rows = []
+    with event_ids_lock:
+        event_ids = itertools.count(session_registry.reserve_ids('events', len(events), last_event_id))
+        for event_data in events:
+            event_data['id'] = next(event_ids)
+            rows.append((
+                event_data['id'],
+                event_data['event_type'],
+                event_data['timestamp'],
+                event_data['repeater_pid'],
+                event_data['viewer_ip'],
+                event_data['server_ip'],
+                event_data['connection_code'],
+                event_data['mode'],
+                event_data['viewer_table_index'],
+                event_data['server_table_index']
+            ))
+            if event_data['event_type'] != 'REPEATER_HEARTBEAT':
+                if len(recent_event_rows) == recent_event_rows.maxlen:
+                    recent_event_rows_floor = recent_event_rows[0][0]
+                recent_event_rows.append((event_data['id'], event_data['timestamp'], format_event_row(rows[-1])))
+        # Queued under the lock so the DB sees ids in allocation order
+        for row in rows:
+            db_writer.submit(f'''
+                INSERT INTO {ensure_event_partition(row[2])} 
+                (id, event_type, timestamp, repeater_pid, viewer_ip, server_ip, 
+                 connection_code, mode, viewer_table_index, server_table_index)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [row])
+    debug_log(f"💾 {len(events)} event(s) queued for DB")
 
 def remove_auth_session(session_id):
     """Remove authorization session when VNC client connects"""
-    if session_id in authorized_sessions:
+    record = session_registry.get(session_id)
+    if record and record.authorized:
         debug_log(f"🗑️ Removing auth session: {session_id}")
-        # Помечаем сессию как использованную в БД
-        conn = sqlite3.connect('/tmp/repeater_events.db')
-        c = conn.cursor()
-        c.execute('''
-            UPDATE device_auth 
-            SET used_at = CURRENT_TIMESTAMP, status = 'used'
-            WHERE session_id = ?
-        ''', (session_id,))
-        conn.commit()
-        conn.close()
+        # Помечаем сессию как использованную в БД (при восстановлении уже помечена)
+        if not replaying_events:
+            db_writer.submit('''
+                UPDATE device_auth 
+                SET used_at = CURRENT_TIMESTAMP, status = 'used'
+                WHERE session_id = ?
+            ''', [(session_id,)])
         # Удаляем из памяти
-        del authorized_sessions[session_id]
+        session_registry.update(record, authorized=False, mapped=False)
         return True
     return False
 
+def serialize_connection(record):
+    """Dashboard representation of a session record"""
+    return {
+        'session_id': record.session_id,
+        'serial_id': record.serial_id or '',
+        'client_ip': record.client_ip or '',
+        'server_connected': record.server_connected,
+        'server_ip': record.server_ip,
+        'viewer_connected': record.viewer_connected,
+        'viewer_ip': record.viewer_ip,
+        'connection_code': record.connection_code,
+        'created_time': record.created_at,
+        'vnc_url': f"/vnc/{record.session_id}" if record.server_connected else None
+    }
+
+# Health checks run on a background schedule with cheap targeted probes;
+# the status API, the dashboard and /healthz read the cached results
+HEALTH_PROBE_INTERVAL = 5  # seconds
+DB_WRITER_STALL_TIMEOUT = 30  # seconds queued writes may wait for a commit
+REPEATER_PROCESS_NAMES = ('uvncrepeatersvc', 'uvncrepeater', 'repeater')  # install.sh: /usr/sbin/uvncrepeatersvc
+REPEATER_SERVER_PORT = 5500
+REPEATER_LOOKUP_INTERVAL = 60  # seconds between process table scans when the pid is unknown
+health_checks = {}  # name -> {'ok', 'detail', 'checked_at', 'duration_ms'}
+repeater_lookup = {'pid': None, 'at': 0}
+repeater_lookup_lock = threading.Lock()
+
+def find_repeater_pid():
+    """Pid the repeater reports in its events, else a rate-limited lookup by process or executable name"""
+    with liveness_lock:
+        pid, row = max(repeater_liveness.items(), key=lambda item: item[1][1], default=(None, None))
+    # Only a pid heard from recently; an old one may belong to another process by now
+    reported = pid if row and time.time() - row[1] < HEARTBEAT_TIMEOUT else None
+    with repeater_lookup_lock:
+        for pid in (reported, repeater_lookup['pid']):
+            if pid and psutil.pid_exists(pid):
+                return pid
+        now = time.time()
+        if now - repeater_lookup['at'] >= REPEATER_LOOKUP_INTERVAL:
+            repeater_lookup['at'] = now
+            repeater_lookup['pid'] = next((proc.pid for proc in psutil.process_iter(['name', 'exe'])
+                                           if proc.info['name'] in REPEATER_PROCESS_NAMES
+                                           or os.path.basename(proc.info['exe'] or '') in REPEATER_PROCESS_NAMES),
+                                          None)
+        return repeater_lookup['pid']
+
+def probe_repeater_process():
+    """Repeater process and its listening ports, read from the process's own
+    sockets: the repeater takes any connection to 5500 for a server and
+    waits on its ID, so the ports are never connected to"""
+    pid = find_repeater_pid()
+    if pid is None:
+        return False, 'process not found'
+    try:
+        proc = psutil.Process(pid)
+        # net_connections() replaced connections() in psutil 6
+        connections = getattr(proc, 'net_connections', proc.connections)(kind='tcp')
+    except psutil.NoSuchProcess:
+        return False, f'pid {pid} exited'
+    except psutil.AccessDenied:
+        return True, f'pid {pid}, ports not readable'
+    listening = {conn.laddr.port for conn in connections if conn.status == psutil.CONN_LISTEN}
+    missing = [port for port in (REPEATER_SERVER_PORT, VNC_REPEATER_PORT) if port not in listening]
+    if missing:
+        return False, f'pid {pid} not listening on {", ".join(map(str, missing))}'
+    return True, f'pid {pid} listening on {REPEATER_SERVER_PORT}, {VNC_REPEATER_PORT}'
+
+def probe_repeater_events():
+    if event_listener_server is None or not event_listener_server.is_serving():
+        return False, 'event listener not running'
+    age = int(time.time() - repeater_last_heartbeat)
+    if age >= HEARTBEAT_TIMEOUT:
+        return False, f'no heartbeat for {age}s'
+    return True, f'last heartbeat {age}s ago'
+
+def probe_vnc_proxy():
+    if vnc_proxy is None:
+        return False, 'not started'
+    workers = vnc_proxy.status()
+    alive = sum(worker['alive'] for worker in workers)
+    return alive > 0, f'{alive}/{len(workers)} workers alive'
+
+def probe_db_writer():
+    if db_writer.thread is None or not db_writer.thread.is_alive():
+        return False, 'writer thread stopped'
+    depth = db_writer.queue.qsize()
+    age = int(time.time() - db_writer.last_commit)
+    if depth and age > DB_WRITER_STALL_TIMEOUT:
+        return False, f'{depth} queued, no commit for {age}s'
+    return True, f'{depth} queued'
+
+HEALTH_PROBES = {
+    'repeater_process': probe_repeater_process,
+    'repeater_events': probe_repeater_events,
+    'vnc_proxy': probe_vnc_proxy,
+    'db_writer': probe_db_writer,
+}
+
+def run_health_probes():
+    """Refresh every cached check, publishing service status when one flips"""
+    changed = False
+    for name, probe in HEALTH_PROBES.items():
+        started = time.perf_counter()
+        try:
+            ok, detail = probe()
+        except Exception as e:
+            ok, detail = False, f'probe failed: {e}'
+        previous = health_checks.get(name)
+        changed |= previous is None or previous['ok'] != ok
+        health_checks[name] = {
+            'ok': ok,
+            'detail': detail,
+            'checked_at': time.time(),
+            'duration_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+    if changed:
+        publish_service_status()
+
+def health_prober():
+    while True:
+        run_health_probes()
+        time.sleep(HEALTH_PROBE_INTERVAL)
+
+def start_health_prober():
+    threading.Thread(target=health_prober, name='health', daemon=True).start()
+
+# Resource usage of the listener, the VNC proxy workers and the repeater,
+# sampled every second into fixed-size 1s/1m/1h tiers so memory stays
+# bounded whatever the uptime
+RESOURCE_SAMPLE_INTERVAL = 1  # seconds
+RESOURCE_FIELDS = ('cpu_percent', 'rss_bytes', 'open_fds', 'threads', 'sockets')
+RESOURCE_TIERS = ((1, 600), (60, 1440), (3600, 720))  # (seconds per point, points kept): 10 min, 1 day, 30 days
+
+class ResourceSeries:
+    """Samples of one process group in every tier.
+
+    Each sample lands in the 1s tier; a coarser tier gets the average of
+    the samples of its period once the period is over.
+    """
+
+    def __init__(self):
+        self.tiers = {step: deque(maxlen=size) for step, size in RESOURCE_TIERS}
+        self.periods = {step: [None, 0, [0.0] * len(RESOURCE_FIELDS)] for step, _ in RESOURCE_TIERS[1:]}
+
+    def add(self, timestamp, values):
+        self.tiers[1].append((timestamp, *values))
+        for step, period in self.periods.items():
+            start = timestamp - timestamp % step
+            if period[0] != start:
+                if period[1]:
+                    self.tiers[step].append((period[0], *(round(total / period[1], 2) for total in period[2])))
+                period[:] = [start, 0, [0.0] * len(RESOURCE_FIELDS)]
+            period[1] += 1
+            for index, value in enumerate(values):
+                period[2][index] += value
+
+class ResourceSampler:
+    """Background sampler of per-process CPU, RSS, fds, threads and sockets"""
+
+    def __init__(self):
+        self.series = {group: ResourceSeries() for group in ('listener', 'vnc_proxy', 'repeater')}
+        self.latest = {}  # group -> {'pids': [...], field: value}
+        self.processes = {}  # pid -> psutil.Process, kept for cpu_percent deltas
+        self.lock = threading.Lock()
+
+    def group_pids(self):
+        pids = {'listener': [os.getpid()], 'repeater': []}
+        pids['vnc_proxy'] = [worker.process.pid for worker in (vnc_proxy.workers if vnc_proxy else ())
+                             if worker.process and worker.process.poll() is None]
+        repeater_pid = find_repeater_pid()
+        if repeater_pid:
+            pids['repeater'].append(repeater_pid)
+        return pids
+
+    def process(self, pid):
+        proc = self.processes.get(pid)
+        if proc is None:
+            proc = self.processes[pid] = psutil.Process(pid)
+            proc.cpu_percent(None)  # first call only starts the measurement
+        return proc
+
+    @staticmethod
+    def count_fds(proc):
+        """(open fds, sockets) from /proc/<pid>/fd, without scanning the host's connection table"""
+        fd_dir = f'/proc/{proc.pid}/fd'
+        if not os.path.isdir(fd_dir):
+            return proc.num_fds(), len(proc.connections('all'))
+        fds = os.listdir(fd_dir)
+        sockets = 0
+        for fd in fds:
+            try:
+                sockets += os.readlink(f'{fd_dir}/{fd}').startswith('socket:')
+            except OSError:
+                pass  # closed while we looked
+        return len(fds), sockets
+
+    def sample(self):
+        timestamp = int(time.time())
+        live = set()
+        for group, pids in self.group_pids().items():
+            values = [0.0, 0, 0, 0, 0]
+            for pid in pids:
+                try:
+                    proc = self.process(pid)
+                    with proc.oneshot():
+                        values[0] += proc.cpu_percent(None)
+                        values[1] += proc.memory_info().rss
+                        values[3] += proc.num_threads()
+                    fds, sockets = self.count_fds(proc)
+                    values[2] += fds
+                    values[4] += sockets
+                    live.add(pid)
+                except (psutil.Error, OSError):
+                    pass  # exited or not ours to inspect
+            values[0] = round(values[0], 1)
+            with self.lock:
+                self.series[group].add(timestamp, values)
+                self.latest[group] = {'pids': pids, **dict(zip(RESOURCE_FIELDS, values))}
+        for pid in [pid for pid in self.processes if pid not in live]:
+            del self.processes[pid]
+
+    def points(self, step, limit):
+        """Newest limit points of tier step per group"""
+        with self.lock:
+            return {group: {'pids': self.latest.get(group, {}).get('pids', []),
+                            'samples': list(series.tiers[step])[-limit:]}
+                    for group, series in self.series.items()}
+
+    def run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                debug_log(f"❌ Resource sampling failed: {e}")
+            time.sleep(RESOURCE_SAMPLE_INTERVAL)
+
+resource_sampler = ResourceSampler()
+LabeledGauge('uvnc_process_resource', 'Latest resource sample per process group', ('group', 'resource'),
+             lambda: [((group, field), latest[field]) for group, latest in list(resource_sampler.latest.items())
+                      for field in RESOURCE_FIELDS])
+
+def start_resource_sampler():
+    threading.Thread(target=resource_sampler.run, name='resources', daemon=True).start()
+
+@app.route('/api/resources')
+def get_resources():
+    """Resource series per process group: ?tier=1|60|3600 seconds per point, ?points= newest N"""
+    try:
+        step = int(request.args.get('tier', 1))
+        limit = int(request.args.get('points', dict(RESOURCE_TIERS).get(step, 0)))
+    except ValueError:
+        return jsonify({'error': 'Invalid tier or points'}), 400
+    if step not in dict(RESOURCE_TIERS) or limit < 1:
+        return jsonify({'error': f"tier must be one of {', '.join(str(step) for step, _ in RESOURCE_TIERS)}"}), 400
+    return jsonify({
+        'tier': step,
+        'fields': ('timestamp',) + RESOURCE_FIELDS,
+        'groups': resource_sampler.points(step, limit)
+    })
+
+def get_service_status():
+    """Current repeater and VNC proxy status"""
+    return {
+        'repeater': (time.time() - repeater_last_heartbeat) < HEARTBEAT_TIMEOUT,
+        'vnc_proxy': bool(vnc_proxy and vnc_proxy.is_serving()),
+        'vnc_proxy_workers': vnc_proxy.status() if vnc_proxy else [],
+        'health': {name: check['ok'] for name, check in list(health_checks.items())}
+    }
+
+# Dashboard push stream (Server-Sent Events)
+DASHBOARD_STREAM_QUEUE_SIZE = 1000  # pending messages before a slow client is dropped
+DASHBOARD_STREAM_TICK = 2  # seconds between service status checks
+DASHBOARD_STREAM_KEEPALIVE = 15  # seconds between keepalive comments
+dashboard_subscribers = set()
+dashboard_subscribers_lock = threading.Lock()
+last_service_status = None
+
+def format_sse(event, data):
+    """Encode one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def publish_dashboard_event(event, data):
+    """Send a message to every dashboard stream subscriber"""
+    if not dashboard_subscribers:
+        return
+    message = format_sse(event, data)
+    with dashboard_subscribers_lock:
+        for subscriber in list(dashboard_subscribers):
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # Slow client: drop it, EventSource reconnects and gets a fresh snapshot
+                dashboard_subscribers.discard(subscriber)
+                debug_log("⚠️ Dropped slow dashboard stream subscriber")
+
+def publish_service_status():
+    """Publish service status if it changed since the last publish"""
+    global last_service_status
+    status = get_service_status()
+    with dashboard_subscribers_lock:
+        if status == last_service_status:
+            return
+        last_service_status = status
+    publish_dashboard_event('service_status', status)
+
+@app.route('/api/dashboard/stream')
+def dashboard_stream():
+    """Stream dashboard snapshot followed by per-connection deltas"""
+    debug_log(f"📡 API CALL: /api/dashboard/stream")
+    subscriber = queue.Queue(maxsize=DASHBOARD_STREAM_QUEUE_SIZE)
+    # Subscribe before taking the snapshot so no change is lost in between;
+    # the client applies added/updated as upserts
+    with dashboard_subscribers_lock:
+        dashboard_subscribers.add(subscriber)
+
+    def generate():
+        try:
+            yield format_sse('snapshot', {
+                'connections': dashboard_connections(),
+                'service_status': get_service_status()
+            })
+            last_keepalive = time.monotonic()
+            while subscriber in dashboard_subscribers:
+                try:
+                    yield subscriber.get(timeout=DASHBOARD_STREAM_TICK)
+                except queue.Empty:
+                    publish_service_status()
+                    if time.monotonic() - last_keepalive >= DASHBOARD_STREAM_KEEPALIVE:
+                        last_keepalive = time.monotonic()
+                        yield ': keepalive\n\n'
+        finally:
+            with dashboard_subscribers_lock:
+                dashboard_subscribers.discard(subscriber)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def dashboard_connections():
+    """Snapshot connections with live VNC proxy traffic attached"""
+    traffic = vnc_proxy.session_traffic() if vnc_proxy else {}
+    return [dict(connection, traffic=traffic.get(session_id))
+            for session_id, connection in state_engine.snapshot.items()]
+
 # API endpoints for frontend
 @app.route('/api/dashboard/connections')
 def get_dashboard_connections():
     """Get current connections for dashboard"""
     debug_log(f"📡 API CALL: /api/dashboard/connections")
-    # Check service statuses
-    current_time = time.time()
-    repeater_status = (current_time - repeater_last_heartbeat) < HEARTBEAT_TIMEOUT
-    websockify_status = websockify_process and websockify_process.poll() is None
-    connections_list = []
-    for session_id, conn_data in dashboard_connections.items():
-        connections_list.append({
-            'session_id': session_id,
-            'serial_id': conn_data.get('serial_id', ''),
-            'client_ip': conn_data.get('client_ip', ''),
-            'server_connected': conn_data.get('server_connected', False),
-            'server_ip': conn_data.get('server_ip', ''),
-            'viewer_connected': conn_data.get('viewer_connected', False),
-            'viewer_ip': conn_data.get('viewer_ip', ''),
-            'connection_code': conn_data.get('connection_code'),
-            'created_time': conn_data.get('created_time', 0),
-            'vnc_url': f"/vnc/{session_id}" if conn_data.get('server_connected') else None
-        })
+    connections_list = dashboard_connections()
     result = {
         'connections': connections_list,
-        'service_status': {
-            'repeater': repeater_status,
-            'websockify': websockify_status
-        }
+        'service_status': get_service_status()
     }
     debug_log(f"   Returning {len(connections_list)} connections")
     return jsonify(result)
@@ -621,92 +2387,730 @@ def get_dashboard_connections():
 @app.route('/api/dashboard/remove_connection/<int:session_id>', methods=['POST'])
 def remove_dashboard_connection(session_id):
     """Manually remove connection from dashboard"""
-    if session_id in dashboard_connections:
-        del dashboard_connections[session_id]
+    if state_engine.call(hide_dashboard_connection, session_id):
         debug_log(f"🗑️ Manually removed dashboard connection: {session_id}")
         return jsonify({'status': 'success'})
     else:
         return jsonify({'error': 'Connection not found'}), 404
 
+def hide_dashboard_connection(session_id):
+    """Engine command: remove a session from the dashboard, keeping its authorization"""
+    record = session_registry.get(session_id)
+    if record and record.on_dashboard:
+        session_registry.update(record, on_dashboard=False)
+        if not replaying_events:
+            # Logged so a restore from an older snapshot does not bring the card back
+            removal_id = session_registry.reserve_ids('dashboard_removals', 1, last_removal_id)
+            db_writer.submit('''
+                INSERT INTO dashboard_removals (id, session_id, removed_at) VALUES (?, ?, ?)
+            ''', [(removal_id, session_id, time.time())])
+        return True
+    return False
+
+EVENTS_PAGE_SIZE = 50
+EVENTS_MAX_PAGE_SIZE = 1000
+
+def page_limit(args, default):
+    """?limit= as an int within 1..EVENTS_MAX_PAGE_SIZE, ValueError otherwise"""
+    limit = int(args.get('limit', default))
+    if not 1 <= limit <= EVENTS_MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {EVENTS_MAX_PAGE_SIZE}")
+    return limit
+
+def build_events_filter(args):
+    """Build WHERE clauses and params for event queries from request args"""
+    clauses = []
+    params = []
+    event_types = [t for t in args.get('event_type', '').split(',') if t]
+    if event_types:
+        clauses.append(f"event_type IN ({','.join('?' * len(event_types))})")
+        params.extend(event_types)
+    else:
+        clauses.append("event_type != 'REPEATER_HEARTBEAT'")
+    since, until = events_time_range(args)
+    if since is not None:
+        clauses.append('timestamp >= ?')
+        params.append(since)
+    if until is not None:
+        clauses.append('timestamp < ?')
+        params.append(until)
+    for field in ('viewer_ip', 'server_ip'):
+        if args.get(field):
+            clauses.append(f'{field} = ?')
+            params.append(args[field])
+    if args.get('connection_code'):
+        clauses.append('connection_code = ?')
+        params.append(int(args['connection_code']))
+    return clauses, params
+
+def events_time_range(args):
+    """since/until request args as ints (None when absent)"""
+    since = int(args['since']) if args.get('since') else None
+    until = int(args['until']) if args.get('until') else None
+    return since, until
+
+def query_events(clauses, params, limit, since=None, until=None):
+    """Newest-first events matching clauses, reading only overlapping partitions.
+
+    Partitions are visited newest range first and the scan stops once the
+    page is full and the next partition cannot hold a newer row.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    rows = []
+    for name, start, end in partitions_overlapping(since, until):
+        if len(rows) >= limit and end <= rows[limit - 1][2]:
+            break
+        rows.extend(query_partition(conn, f'''
+            SELECT id, event_type, timestamp, repeater_pid, viewer_ip, server_ip,
+                   connection_code, mode
+            FROM {name}
+            WHERE {' AND '.join(clauses)}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        ''', params + [limit]))
+        rows.sort(key=lambda row: (row[2], row[0]), reverse=True)
+        del rows[limit:]
+    conn.close()
+    return rows
+
+def format_event_row(row):
+    """Convert an events row into API representation"""
+    return {
+        'id': row[0],
+        'event_type': row[1],
+        'timestamp': datetime.fromtimestamp(row[2]).strftime('%Y-%m-%d %H:%M:%S'),
+        'repeater_pid': row[3],
+        'viewer_ip': row[4],
+        'server_ip': row[5],
+        'connection_code': row[6],
+        'mode': row[7]
+    }
+
 @app.route('/api/events/list')
 def get_events_list():
-    """Get events from database"""
+    """Get events from database.
+
+    Filters: since/until (unix time), event_type (comma separated, heartbeats
+    excluded by default), viewer_ip, server_ip, connection_code. Pages are
+    keyset-paginated on (timestamp, id): pass the X-Next-Cursor header of the
+    previous response as ?cursor= to get the next (older) page.
+    """
     debug_log(f"📡 API CALL: /api/events/list")
-    conn = sqlite3.connect('/tmp/repeater_events.db')
+    try:
+        clauses, params = build_events_filter(request.args)
+        since, until = events_time_range(request.args)
+        limit = page_limit(request.args, EVENTS_PAGE_SIZE)
+        if request.args.get('cursor'):
+            cursor_ts, cursor_id = (int(part) for part in request.args['cursor'].split(':'))
+            clauses.append('(timestamp, id) < (?, ?)')
+            params.extend((cursor_ts, cursor_id))
+            until = cursor_ts + 1 if until is None else min(until, cursor_ts + 1)
+    except ValueError:
+        return jsonify({'error': 'Invalid filter, cursor or limit'}), 400
+    rows = query_events(clauses, params, limit, since, until)
+    response = jsonify([format_event_row(row) for row in rows])
+    if len(rows) == limit:
+        response.headers['X-Next-Cursor'] = f"{rows[-1][2]}:{rows[-1][0]}"
+    debug_log(f"   Returning {len(rows)} events from DB")
+    return response
+
+EVENTS_TAIL_LIMIT = 500
+
+@app.route('/api/events/tail')
+def get_events_tail():
+    """Get events newer than after_id (and not older than since), oldest first.
+
+    Without after_id returns the newest rows held in memory. Served from the
+    in-memory ring of recent rows; only clients that fell further behind than
+    the ring reach the database. Responses carry an ETag, so an idle poll with
+    If-None-Match costs a 304.
+    """
+    try:
+        after_id = int(request.args.get('after_id', 0))
+        since = int(request.args.get('since', 0))
+        limit = page_limit(request.args, EVENTS_TAIL_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'Invalid after_id, since or limit'}), 400
+    rows = list(recent_event_rows)
+    # With shared state other workers store events too, only the DB has them all
+    use_ring = not session_registry.shared
+    if 'after_id' not in request.args and use_ring:
+        # First call: newest rows the ring has, client continues from last_id
+        events = [row for _, timestamp, row in rows if timestamp >= since][-limit:]
+    elif use_ring and after_id >= recent_event_rows_floor:
+        events = [row for event_id, timestamp, row in rows
+                  if event_id > after_id and timestamp >= since][:limit]
+    else:
+        debug_log(f"📡 Tail after_id={after_id} is behind the ring, reading DB")
+        newest = 'after_id' not in request.args
+        conn = sqlite3.connect(DB_PATH)
+        rows = []
+        for name, _, _ in partitions_overlapping(since or None):
+            rows.extend(query_partition(conn, f'''
+                SELECT id, event_type, timestamp, repeater_pid, viewer_ip, server_ip,
+                       connection_code, mode
+                FROM {name}
+                WHERE id > ? AND timestamp >= ? AND event_type != 'REPEATER_HEARTBEAT'
+                ORDER BY id {'DESC' if newest else ''}
+                LIMIT ?
+            ''', (after_id, since, limit)))
+        conn.close()
+        rows.sort()
+        rows = rows[-limit:] if newest else rows[:limit]
+        events = [format_event_row(row) for row in rows]
+    last_id = events[-1]['id'] if events else after_id
+    response = jsonify({'events': events, 'last_id': last_id})
+    return conditional_response(response)
+
+def conditional_response(response):
+    """Add ETag and answer 304 when the client already has this body"""
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/status')
+def get_status():
+    """Service status only, with ETag support for cheap polling"""
+    return conditional_response(jsonify(get_service_status()))
+
+@app.route('/healthz')
+def healthz():
+    """Readiness from the cached health checks: 200 when all pass and are fresh"""
+    checks = dict(health_checks)
+    fresh = time.time() - 3 * HEALTH_PROBE_INTERVAL
+    ready = bool(checks) and all(check['ok'] and check['checked_at'] >= fresh for check in checks.values())
+    return jsonify({'ready': ready, 'checks': checks}), 200 if ready else 503
+
+@app.route('/api/repeater/liveness')
+def get_repeater_liveness():
+    """Per-repeater liveness rows and recorded outages (newest first)"""
+    try:
+        since = int(request.args.get('since', 0))
+        limit = page_limit(request.args, EVENTS_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'Invalid since or limit'}), 400
+    with liveness_lock:
+        repeaters = [{
+            'repeater_pid': pid,
+            'first_seen': row[0],
+            'last_seen': row[1],
+            'heartbeat_count': row[2],
+            'max_sessions': row[3]
+        } for pid, row in repeater_liveness.items() if row[1] >= since]
+    repeaters.sort(key=lambda repeater: repeater['last_seen'], reverse=True)
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     c.execute('''
-        SELECT * FROM events 
-        WHERE event_type != 'REPEATER_HEARTBEAT'
-        ORDER BY timestamp DESC 
-        LIMIT 50
-    ''')
-    events = []
-    for row in c.fetchall():
-        events.append({
-            'id': row[0],
-            'event_type': row[1],
-            'timestamp': datetime.fromtimestamp(row[2]).strftime('%Y-%m-%d %H:%M:%S'),
-            'repeater_pid': row[3],
-            'viewer_ip': row[4],
-            'server_ip': row[5],
-            'connection_code': row[6],
-            'mode': row[7]
-        })
+        SELECT repeater_pid, started_at, ended_at, duration
+        FROM repeater_outages
+        WHERE ended_at >= ?
+        ORDER BY started_at DESC
+        LIMIT ?
+    ''', (since, limit))
+    outages = [{
+        'repeater_pid': row[0],
+        'started_at': row[1],
+        'ended_at': row[2],
+        'duration': row[3]
+    } for row in c.fetchall()]
+    conn.close()
+    return jsonify({'repeaters': repeaters[:limit], 'outages': outages})
+
+def duration_percentile(buckets, count, max_duration, fraction):
+    """Upper-bound estimate of a duration percentile from histogram buckets"""
+    if not count:
+        return 0
+    target = fraction * count
+    seen = 0
+    for bound, bucket_count in zip(SESSION_DURATION_BUCKETS, buckets):
+        seen += bucket_count
+        if seen >= target:
+            return min(bound, max_duration)
+    return max_duration
+
+@app.route('/api/stats/sessions')
+def get_session_stats():
+    """Session count and duration stats from hourly rollups.
+
+    Args: since/until (unix time, default last 24h), server_ip filter,
+    group=hour|total and by_server=1 to split rows per server IP.
+    """
+    try:
+        now = int(time.time())
+        since = int(request.args.get('since') or now - 86400)
+        until = int(request.args.get('until') or now + 1)
+    except ValueError:
+        return jsonify({'error': 'Invalid since or until'}), 400
+    group_by_hour = request.args.get('group', 'hour') == 'hour'
+    by_server = request.args.get('by_server') == '1'
+    sql = '''
+        SELECT hour_ts, server_ip, session_count, total_duration, max_duration, duration_buckets
+        FROM session_rollups WHERE hour_ts >= ? AND hour_ts < ?
+    '''
+    params = [since - since % 3600, until]
+    if request.args.get('server_ip'):
+        sql += ' AND server_ip = ?'
+        params.append(request.args['server_ip'])
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute(sql, params).fetchall()
+    conn.close()
+    groups = {}
+    for hour_ts, server_ip, count, total, max_duration, buckets in rows:
+        key = (hour_ts if group_by_hour else None, server_ip if by_server else None)
+        group = groups.setdefault(key, [0, 0, 0, [0] * len(SESSION_DURATION_BUCKETS)])
+        group[0] += count
+        group[1] += total
+        group[2] = max(group[2], max_duration)
+        for index, bucket_count in enumerate(buckets.split(',')):
+            group[3][index] += int(bucket_count)
+    stats = []
+    ordered = sorted(groups.items(), key=lambda item: (item[0][0] or 0, item[0][1] or ''))
+    for (hour_ts, server_ip), (count, total, max_duration, buckets) in ordered:
+        item = {
+            'session_count': count,
+            'total_duration': total,
+            'avg_duration': round(total / count, 1) if count else 0,
+            'p95_duration': duration_percentile(buckets, count, max_duration, 0.95),
+            'max_duration': max_duration
+        }
+        if group_by_hour:
+            item['hour'] = hour_ts
+        if by_server:
+            item['server_ip'] = server_ip
+        stats.append(item)
+    return jsonify({'since': since, 'until': until, 'stats': stats})
+
+@app.route('/api/sessions')
+def get_sessions_list():
+    """Finished sessions, newest first; ?cursor=end_ts:id from X-Next-Cursor pages back"""
+    clauses = ['1 = 1']
+    params = []
+    try:
+        if request.args.get('since'):
+            clauses.append('end_ts >= ?')
+            params.append(int(request.args['since']))
+        if request.args.get('until'):
+            clauses.append('end_ts < ?')
+            params.append(int(request.args['until']))
+        for field in ('server_ip', 'viewer_ip', 'serial_id'):
+            if request.args.get(field):
+                clauses.append(f'{field} = ?')
+                params.append(request.args[field])
+        if request.args.get('cursor'):
+            cursor_ts, cursor_id = (int(part) for part in request.args['cursor'].split(':'))
+            clauses.append('(end_ts, id) < (?, ?)')
+            params.extend((cursor_ts, cursor_id))
+        limit = page_limit(request.args, EVENTS_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'Invalid filter, cursor or limit'}), 400
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute(f'''
+        SELECT id, connection_code, session_id, serial_id, server_ip, viewer_ip,
+               start_ts, end_ts, duration, end_reason
+        FROM sessions
+        WHERE {' AND '.join(clauses)}
+        ORDER BY end_ts DESC, id DESC
+        LIMIT ?
+    ''', params + [limit]).fetchall()
     conn.close()
-    debug_log(f"   Returning {len(events)} events from DB")
-    return jsonify(events)
+    response = jsonify([{
+        'id': row[0],
+        'connection_code': row[1],
+        'session_id': row[2],
+        'serial_id': row[3],
+        'server_ip': row[4],
+        'viewer_ip': row[5],
+        'start_ts': row[6],
+        'end_ts': row[7],
+        'duration': row[8],
+        'end_reason': row[9]
+    } for row in rows])
+    if len(rows) == limit:
+        response.headers['X-Next-Cursor'] = f"{rows[-1][7]}:{rows[-1][0]}"
+    return response
+
+# Bulk export for audits: rows are read in keyset pages, each page a short
+# read of its own, so a month of history streams in constant memory and never
+# pins a WAL snapshot the writer would have to wait for
+EXPORT_BATCH_SIZE = 5000
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_COLUMNS = {
+    'events': ('id', 'event_type', 'timestamp', 'repeater_pid', 'viewer_ip', 'server_ip',
+               'connection_code', 'mode', 'viewer_table_index', 'server_table_index'),
+    'device_auth': ('id', 'serial_id', 'session_id', 'client_ip', 'server_slot',
+                    'created_at', 'used_at', 'status'),
+    'sessions': ('id', 'connection_code', 'session_id', 'serial_id', 'server_ip', 'viewer_ip',
+                 'start_ts', 'end_ts', 'duration', 'end_reason'),
+}
+
+def export_sources(kind, args):
+    """(table, clauses, params, order) to read for an export, oldest rows first"""
+    if kind == 'events':
+        clauses, params = build_events_filter(args)
+        since, until = events_time_range(args)
+        return [(name, clauses, params, ('timestamp', 'id'))
+                for name, _, _ in reversed(partitions_overlapping(since, until))]
+    clauses = []
+    params = []
+    if kind == 'device_auth':
+        time_column, time_value = 'created_at', "datetime(?, 'unixepoch')"
+        fields = ('serial_id', 'client_ip', 'status')
+    else:
+        time_column, time_value = 'end_ts', '?'
+        fields = ('server_ip', 'viewer_ip', 'serial_id')
+    since, until = events_time_range(args)
+    if since is not None:
+        clauses.append(f'{time_column} >= {time_value}')
+        params.append(since)
+    if until is not None:
+        clauses.append(f'{time_column} < {time_value}')
+        params.append(until)
+    for field in fields:
+        if args.get(field):
+            clauses.append(f'{field} = ?')
+            params.append(args[field])
+    return [(kind, clauses, params, ('id',))]
+
+def export_pages(conn, table, columns, clauses, params, order):
+    """Matching rows of table as pages of EXPORT_BATCH_SIZE, continuing after the last key"""
+    key_indexes = [columns.index(column) for column in order]
+    after = []
+    while True:
+        page_clauses = list(clauses)
+        if after:
+            page_clauses.append(f"({', '.join(order)}) > ({', '.join('?' * len(order))})")
+        rows = query_partition(conn, f'''
+            SELECT {', '.join(columns)}
+            FROM {table}
+            WHERE {' AND '.join(page_clauses) or '1 = 1'}
+            ORDER BY {', '.join(order)}
+            LIMIT ?
+        ''', params + after + [EXPORT_BATCH_SIZE])
+        if rows:
+            yield rows
+        if len(rows) < EXPORT_BATCH_SIZE:
+            return
+        after = [rows[-1][index] for index in key_indexes]
+
+def generate_export(kind, sources, export_format, compress):
+    """Encode export pages as NDJSON or CSV, gzipped on the fly when asked"""
+    columns = EXPORT_COLUMNS[kind]
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if export_format == 'csv':
+        writer.writerow(columns)
+    exported = 0
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        for table, clauses, params, order in sources:
+            for rows in export_pages(conn, table, columns, clauses, params, order):
+                if export_format == 'csv':
+                    writer.writerows(rows)
+                else:
+                    buffer.writelines(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+                data = buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+                exported += len(rows)
+                if compressor:
+                    data = compressor.compress(data)
+                if data:
+                    yield data
+        data = buffer.getvalue().encode()
+        if compressor:
+            data = compressor.compress(data) + compressor.flush()
+        if data:
+            yield data
+    finally:
+        conn.close()
+    debug_log(f"📦 Exported {exported} {kind} rows")
+
+@app.route('/api/export/<kind>')
+def export_rows(kind):
+    """Stream events, device_auth or sessions rows, oldest first.
+
+    Filters: since/until (unix time) plus the fields of the matching list
+    API (events: event_type, viewer_ip, server_ip, connection_code;
+    device_auth: serial_id, client_ip, status; sessions: server_ip,
+    viewer_ip, serial_id). ?format=ndjson (default) or csv, ?gzip=1
+    compresses the stream.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if kind not in EXPORT_COLUMNS or export_format not in EXPORT_FORMATS:
+        return jsonify({'error': 'Unknown export or format'}), 404
+    try:
+        sources = export_sources(kind, request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid filter'}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+    filename = f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.{export_format}" + ('.gz' if compress else '')
+    return Response(generate_export(kind, sources, export_format, compress),
+                    mimetype='application/gzip' if compress else EXPORT_FORMATS[export_format],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus text exposition of listener metrics"""
+    lines = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
 
 # Authorization API endpoint
 @app.route('/api/vnc/server/take_slot', methods=['POST'])
 def take_slot():
-    """Handle device authorization and create dashboard connection"""
+    """Handle device authorization and create dashboard connection.
+
+    A retry from the same device within session_timeout gets its pending
+    session back; an optional request_key (or Idempotency-Key header)
+    returns the first response for that key even after the session is used.
+    When the repeater is at MaxSessions the request waits in line for up to
+    ?wait= seconds (default SLOT_WAIT_TIMEOUT), then gets 503 with Retry-After.
+    """
     try:
         data = request.get_json()
         if not data or 'serial_id' not in data:
             return jsonify({'error': 'Missing serial_id'}), 400
         serial_id = data['serial_id']
         client_ip = request.remote_addr
-        # Generate unique session ID
-        session_id = generate_session_id()
         # Get server address
         server_host = get_server_host(request)
         server_slot = f"{server_host}:5500"
-        # Store authorization session
-        authorized_sessions[session_id] = {
-            'serial_id': serial_id,
-            'client_ip': client_ip,
-            'server_slot': server_slot,
-            'created_at': time.time(),
-            'status': 'ready',
-            'connection_code': None
-        }
-        # Create dashboard connection
-        dashboard_connections[session_id] = {
-            'serial_id': serial_id,
-            'client_ip': client_ip,
-            'server_connected': False,
-            'server_ip': '',
-            'viewer_connected': False,
-            'viewer_ip': '',
-            'connection_code': None,
-            'created_time': time.time()
-        }
-        # Store in database for audit
-        store_auth_session(serial_id, session_id, client_ip, server_slot)
-        debug_log(f"✅ New dashboard connection created: session_id={session_id}, serial_id={serial_id}, client_ip={client_ip}")
+        request_key = data.get('request_key') or request.headers.get('Idempotency-Key')
+        try:
+            wait = slot_wait_seconds(data)
+        except ValueError:
+            return jsonify({'error': 'Invalid wait'}), 400
+        try:
+            slots, retry_after = acquire_slots([serial_id], client_ip, server_slot, request_key, wait)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 409
+        if slots is None:
+            return repeater_full_response(retry_after)
+        [(_, session_id, reused)] = slots
+        debug_log(f"✅ {'Existing' if reused else 'New'} dashboard connection: session_id={session_id}, serial_id={serial_id}, client_ip={client_ip}")
         return jsonify({
             'session_id': session_id,
             'server_slot': server_slot
         })
+    except RequestKeyConflict as e:
+        return jsonify({'error': str(e)}), 422
     except Exception as e:
         debug_log(f"❌ Error in take_slot: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+TAKE_SLOTS_MAX_BATCH = 1000
+
+@app.route('/api/vnc/server/take_slots', methods=['POST'])
+def take_slots():
+    """Reserve slots for many serial_ids in one state transaction and one DB commit.
+
+    Body: {"serial_ids": [...], "request_key": optional}. Retries are
+    idempotent like take_slot; "reused" marks slots that already existed.
+    Admission waits for capacity for the whole batch, as take_slot does.
+    """
+    data = request.get_json(silent=True) or {}
+    serial_ids = data.get('serial_ids')
+    if not isinstance(serial_ids, list) or not serial_ids or \
+            not all(isinstance(serial_id, str) and serial_id for serial_id in serial_ids):
+        return jsonify({'error': 'serial_ids must be a non-empty list of strings'}), 400
+    if len(serial_ids) > TAKE_SLOTS_MAX_BATCH:
+        return jsonify({'error': f'At most {TAKE_SLOTS_MAX_BATCH} serial_ids per request'}), 413
+    server_slot = f"{get_server_host(request)}:5500"
+    request_key = data.get('request_key') or request.headers.get('Idempotency-Key')
+    try:
+        wait = slot_wait_seconds(data)
+    except ValueError:
+        return jsonify({'error': 'Invalid wait'}), 400
+    try:
+        slots, retry_after = acquire_slots(serial_ids, request.remote_addr, server_slot, request_key, wait)
+    except RequestKeyConflict as e:
+        return jsonify({'error': str(e)}), 422
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        debug_log(f"❌ Error in take_slots: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+    if slots is None:
+        return repeater_full_response(retry_after)
+    debug_log(f"✅ Reserved {len(slots)} slots for {request.remote_addr}, {sum(reused for _, _, reused in slots)} existing")
+    return jsonify({
+        'server_slot': server_slot,
+        'slots': [{'serial_id': serial_id, 'session_id': session_id, 'reused': reused}
+                  for serial_id, session_id, reused in slots]
+    })
+
+SLOTS_TOTAL = Counter('uvnc_slots_total', 'Slot reservations by result', 'result')
+
+# Responses by (client_ip, request_key), oldest first; owned by the state engine
+slot_request_keys = {}  # key -> (expires_at, slots)
+
+class RequestKeyConflict(Exception):
+    """A request_key reused with a different body"""
+
+# Admission against the repeater's MaxSessions: a slot counts from take_slot
+# until its server disconnects, and requests beyond capacity wait in FIFO
+# order instead of sending devices into a refused-connection retry loop
+SLOT_WAIT_TIMEOUT = 25  # seconds a take_slot long-poll may wait, below common proxy timeouts
+SLOT_RETRY_AFTER = 5  # seconds suggested when no reservation is due to expire
+slot_waiters = deque()  # [needed, serial_ids, client_ip, server_slot, request_key, future]; owned by the engine
+
+def slot_wait_seconds(data):
+    """Long-poll time from ?wait= or the body, capped at SLOT_WAIT_TIMEOUT; ValueError unless a finite number"""
+    try:
+        wait = float(request.args.get('wait', data.get('wait', SLOT_WAIT_TIMEOUT)))
+    except (TypeError, ValueError):
+        raise ValueError("wait must be a number")
+    if not math.isfinite(wait):
+        raise ValueError("wait must be finite")
+    return min(max(wait, 0), SLOT_WAIT_TIMEOUT)
+
+def repeater_full_response(retry_after):
+    response = jsonify({'error': 'Repeater is at MaxSessions', 'retry_after': retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def acquire_slots(serial_ids, client_ip, server_slot, request_key, wait):
+    """Reserve slots, waiting up to wait seconds for capacity; returns (slots, retry_after)"""
+    waiter = Future()
+    slots = state_engine.call(request_slots, serial_ids, client_ip, server_slot, request_key, waiter)
+    if slots is not None:
+        return slots, None
+    try:
+        return waiter.result(wait), None
+    except FutureTimeoutError:
+        retry_after = state_engine.call(cancel_slot_wait, waiter)
+        if retry_after is None:
+            # Admitted while the cancel was queued
+            return waiter.result(10), None
+        return None, retry_after
+
+def free_slot_count():
+    """Slots the repeater can still take, None while its MaxSessions is unknown"""
+    max_sessions = repeater_max_sessions()
+    if not max_sessions:
+        return None
+    return max_sessions - session_registry.active_count - session_registry.pending_count
+
+def slots_needed(serial_ids, client_ip, server_slot, request_key, now):
+    """New sessions reserve_slots would create for this request"""
+    cached = slot_request_keys.get((client_ip, request_key)) if request_key is not None else None
+    if cached is not None and cached[0] > now:
+        return 0
+    return sum(find_reusable_slot(serial_id, client_ip, server_slot, now) is None
+               for serial_id in set(serial_ids))
+
+def request_slots(serial_ids, client_ip, server_slot, request_key, waiter):
+    """Engine command: reserve now when the repeater has room, else queue waiter behind earlier ones"""
+    needed = slots_needed(serial_ids, client_ip, server_slot, request_key, time.time())
+    free = free_slot_count()
+    if needed == 0 or free is None or (not slot_waiters and needed <= free):
+        return reserve_slots(serial_ids, client_ip, server_slot, request_key)
+    if needed > repeater_max_sessions():
+        raise ValueError(f"{needed} slots exceed repeater MaxSessions {repeater_max_sessions()}")
+    slot_waiters.append([needed, serial_ids, client_ip, server_slot, request_key, waiter])
+    SLOTS_TOTAL.inc('queued', needed)
+    debug_log(f"⏳ Repeater full, {len(slot_waiters)} slot request(s) waiting")
+    return None
+
+def admit_slot_waiters():
+    """Grant queued slot requests in order while capacity lasts (engine thread)"""
+    free = free_slot_count()
+    while slot_waiters and (free is None or slot_waiters[0][0] <= free):
+        _, serial_ids, client_ip, server_slot, request_key, waiter = slot_waiters.popleft()
+        try:
+            slots = reserve_slots(serial_ids, client_ip, server_slot, request_key)
+        except RequestKeyConflict as e:
+            # The same key completed another request while this one waited
+            waiter.set_exception(e)
+            continue
+        free = free_slot_count()
+        # Released after the next snapshot swap, like engine command results
+        state_engine.submit(lambda: None).add_done_callback(
+            lambda _, waiter=waiter, slots=slots: waiter.set_result(slots))
+
+def wake_slot_waiters(snapshot):
+    """Snapshot listener: capacity freed by another worker arrives as a resync"""
+    if slot_waiters:
+        state_engine.submit(admit_slot_waiters)
+
+if session_registry.shared:
+    state_engine.snapshot_listeners.append(wake_slot_waiters)
+
+def cancel_slot_wait(waiter):
+    """Engine command: drop a timed-out waiter, returns Retry-After seconds (None if already admitted)"""
+    for position, entry in enumerate(slot_waiters):
+        if entry[5] is waiter:
+            break
+    else:
+        return None
+    # Slots still missing for this request and the ones ahead of it
+    missing = sum(slot_waiters[index][0] for index in range(position + 1)) - max(free_slot_count() or 0, 0)
+    del slot_waiters[position]
+    SLOTS_TOTAL.inc('rejected', entry[0])
+    if missing <= 0:
+        return 1
+    # Pending reservations free their slot when they expire unused
+    deadlines = heapq.nsmallest(missing, (record.created_at + session_timeout
+                                          for record in session_registry.authorized_records()
+                                          if record.connection_code is None))
+    if len(deadlines) < missing:
+        return SLOT_RETRY_AFTER
+    return max(1, math.ceil(deadlines[-1] - time.time()))
+
+Gauge('uvnc_repeater_max_sessions', 'MaxSessions reported by the repeater', repeater_max_sessions)
+Gauge('uvnc_slot_waiters', 'take_slot requests waiting for repeater capacity', lambda: len(slot_waiters))
+
+def find_reusable_slot(serial_id, client_ip, server_slot, now):
+    """Newest pending session of serial_id from client_ip still inside session_timeout"""
+    for record in reversed(session_registry.find_by_serial(serial_id)):
+        if record.authorized and record.connection_code is None and record.client_ip == client_ip \
+                and record.server_slot == server_slot and now - record.created_at < session_timeout:
+            return record
+    return None
+
+def reserve_slots(serial_ids, client_ip, server_slot, request_key=None):
+    """Engine command: a slot per serial_id, reusing pending ones; returns [(serial_id, session_id, reused)]"""
+    now = time.time()
+    while slot_request_keys:
+        key = next(iter(slot_request_keys))
+        if slot_request_keys[key][0] > now:
+            break
+        del slot_request_keys[key]
+    if request_key is not None:
+        cached = slot_request_keys.get((client_ip, request_key))
+        if cached is not None:
+            if [slot[0] for slot in cached[1]] != list(serial_ids):
+                raise RequestKeyConflict(f"request_key {request_key!r} was used for other serial_ids")
+            SLOTS_TOTAL.inc('reused', len(cached[1]))
+            return [(serial_id, session_id, True) for serial_id, session_id, _ in cached[1]]
+    slots = []
+    auth_rows = []
+    for serial_id in serial_ids:
+        record = find_reusable_slot(serial_id, client_ip, server_slot, now)
+        if record is not None:
+            slots.append((serial_id, record.session_id, True))
+            continue
+        # Generate unique session ID
+        session_id = generate_session_id()
+        session_registry.add(SessionRecord(session_id, serial_id, client_ip, server_slot, now))
+        auth_rows.append((serial_id, session_id, client_ip, server_slot, now))
+        slots.append((serial_id, session_id, False))
+    # Store in database for audit, one commit for the whole batch
+    store_auth_sessions(auth_rows)
+    SLOTS_TOTAL.inc('new', len(auth_rows))
+    SLOTS_TOTAL.inc('reused', len(slots) - len(auth_rows))
+    if request_key is not None:
+        slot_request_keys[(client_ip, request_key)] = (now + session_timeout, slots)
+    return slots
+
 def generate_session_id():
     """Generate 10-digit session ID"""
     while True:
         session_id = random.randint(1000000000, 9999999999)
-        if session_id not in authorized_sessions:
+        if session_id not in session_registry:
             return session_id
 
 def get_server_host(request):
@@ -718,55 +3122,353 @@ def get_server_host(request):
         host = host.split(':')[0]
     return host
 
-def store_auth_session(serial_id, session_id, client_ip, server_slot):
+def store_auth_session(serial_id, session_id, client_ip, server_slot, created_at=None):
     """Store authorization session in database"""
-    try:
-        conn = sqlite3.connect('/tmp/repeater_events.db')
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO device_auth (serial_id, session_id, client_ip, server_slot)
-            VALUES (?, ?, ?, ?)
-        ''', (serial_id, session_id, client_ip, server_slot))
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        debug_log(f"Error storing auth session: {e}")
+    store_auth_sessions([(serial_id, session_id, client_ip, server_slot,
+                          time.time() if created_at is None else created_at)])
 
+def store_auth_sessions(rows):
+    """Engine command: store (serial_id, session_id, client_ip, server_slot, created_at) rows in one writer commit"""
+    if rows:
+        auth_ids = itertools.count(session_registry.reserve_ids('device_auth', len(rows), last_auth_id))
+        db_writer.submit('''
+            INSERT INTO device_auth (id, serial_id, session_id, client_ip, server_slot, created_ts)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(next(auth_ids),) + row for row in rows])
+
+@timed(CLEANUP_SWEEP_SECONDS)
 def cleanup_expired_sessions():
-    """Clean up expired authorization sessions and dashboard connections"""
+    """Full sweep for sessions nobody scheduled (e.g. left by another worker that died)"""
     current_time = time.time()
-    expired_sessions = []
-    # Clean authorized_sessions
-    for session_id, session_data in authorized_sessions.items():
-        if current_time - session_data['created_at'] > session_timeout:
-            expired_sessions.append(session_id)
-    for session_id in expired_sessions:
-        if session_id in authorized_sessions:
-            del authorized_sessions[session_id]
-        if session_id in dashboard_connections:
-            del dashboard_connections[session_id]
+    expired_sessions = [record for record in session_registry.authorized_records()
+                        if not record.mapped and current_time - record.created_at > session_timeout]
+    for record in expired_sessions:
+        expire_session(record.session_id)
+
+def expire_session(session_id):
+    """Engine command: drop an authorization session not linked to a connected server"""
+    record = session_registry.get(session_id)
+    if record and record.authorized and not record.mapped:
+        session_registry.update(record, authorized=False, on_dashboard=False, mapped=False)
+        EXPIRED_TOTAL.inc('session')
         debug_log(f"🧹 Cleaned up expired session: {session_id}")
+        if slot_waiters:
+            admit_slot_waiters()
+
+def drop_event_partition(conn, name):
+    """Writer task: archive (optionally) and drop one event partition"""
+    if EVENT_ARCHIVE_DIR:
+        os.makedirs(EVENT_ARCHIVE_DIR, exist_ok=True)
+        conn.execute('ATTACH DATABASE ? AS archive', (os.path.join(EVENT_ARCHIVE_DIR, f'{name}.db'),))
+        try:
+            with conn:
+                conn.execute(f'CREATE TABLE IF NOT EXISTS archive.{name} AS SELECT * FROM main.{name}')
+        finally:
+            conn.execute('DETACH DATABASE archive')
+    with conn:
+        conn.execute(f'DROP TABLE IF EXISTS {name}')
+        conn.execute('DELETE FROM event_partitions WHERE name = ?', (name,))
+    debug_log(f"🗑️ Dropped event partition {name}" + (" (archived)" if EVENT_ARCHIVE_DIR else ""))
+
+def incremental_vacuum(conn):
+    """Writer task: return free pages to the filesystem"""
+    conn.execute('PRAGMA incremental_vacuum').fetchall()
+
+def apply_retention():
+    """Drop partitions past EVENT_RETENTION_DAYS, trim the other tables and vacuum"""
+    cutoff = time.time() - EVENT_RETENTION_DAYS * 86400
+    for name, _, end in partitions_overlapping():
+        if end <= cutoff:
+            with event_partitions_lock:
+                event_partitions.pop(name, None)
+            db_writer.run_task(lambda conn, name=name: drop_event_partition(conn, name))
+    db_writer.submit('''
+        DELETE FROM device_auth WHERE created_at < datetime(?, 'unixepoch')
+    ''', [(int(cutoff),)])
+    db_writer.submit('DELETE FROM sessions WHERE end_ts < ?', [(int(cutoff),)])
+    db_writer.submit('DELETE FROM dashboard_removals WHERE removed_at < ?', [(cutoff,)])
+    db_writer.run_task(incremental_vacuum)
+
+def retention_worker():
+    while True:
+        try:
+            apply_retention()
+        except Exception as e:
+            debug_log(f"❌ Retention run failed: {e}")
+        time.sleep(RETENTION_INTERVAL)
+
+threading.Thread(target=retention_worker, name='retention', daemon=True).start()
+
+class ExpiryScheduler:
+    """Min-heap of deadlines, each firing a command on the state engine.
+
+    schedule() replaces any deadline under the same key and cancel() drops
+    it; cancelled heap entries are skipped lazily. The thread sleeps until
+    the earliest deadline, so a tick costs O(expired * log n).
+    """
+
+    def __init__(self):
+        self.heap = []  # (deadline, seq, key)
+        self.entries = {}  # key -> (deadline, seq, func, args)
+        self.seq = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='expiry', daemon=True)
+        self.thread.start()
+
+    def schedule(self, key, deadline, func, *args):
+        with self.condition:
+            seq = next(self.seq)
+            self.entries[key] = (deadline, seq, func, args)
+            heapq.heappush(self.heap, (deadline, seq, key))
+            if len(self.heap) > 2 * len(self.entries) + 64:
+                # Mostly cancelled entries: rebuild from the live ones
+                self.heap = [(entry[0], entry[1], key) for key, entry in self.entries.items()]
+                heapq.heapify(self.heap)
+            if self.heap[0][1] == seq:
+                self.condition.notify()
+
+    def cancel(self, key):
+        with self.condition:
+            self.entries.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def run(self):
+        while True:
+            with self.condition:
+                due = []
+                now = time.time()
+                while self.heap and self.heap[0][0] <= now:
+                    _, seq, key = heapq.heappop(self.heap)
+                    entry = self.entries.get(key)
+                    if entry is not None and entry[1] == seq:
+                        del self.entries[key]
+                        due.append(entry)
+                if not due:
+                    self.condition.wait(self.heap[0][0] - now if self.heap else None)
+            for _, _, func, args in due:
+                state_engine.submit(func, *args)
+
+expiry_scheduler = ExpiryScheduler()
+
+def track_session_expiry(record, was_on_dashboard):
+    """Registry listener: authorized sessions carry a deadline unless linked to a connected server.
+
+    A server disconnect unmaps the session and re-arms its original deadline.
+    """
+    if record.authorized and not record.mapped:
+        if record.session_id not in expiry_scheduler:
+            expiry_scheduler.schedule(record.session_id, record.created_at + session_timeout,
+                                      expire_session, record.session_id)
+    else:
+        expiry_scheduler.cancel(record.session_id)
+
+session_registry.listeners.append(track_session_expiry)
+
+def schedule_heartbeat_expiry():
+    """Publish repeater status when no heartbeat arrives within HEARTBEAT_TIMEOUT"""
+    expiry_scheduler.schedule('repeater_heartbeat', repeater_last_heartbeat + HEARTBEAT_TIMEOUT,
+                              expire_heartbeat)
+
+def expire_heartbeat():
+    EXPIRED_TOTAL.inc('heartbeat')
+    debug_log("⚠️ Repeater heartbeat is stale")
+    publish_service_status()
+
+# Backstop for sessions without a deadline: in shared state those of a
+# worker that died, in memory any the listener missed
+EXPIRY_SWEEP_INTERVAL = 600
 
-# Background thread for cleaning expired sessions
 def session_cleanup_worker():
     while True:
-        time.sleep(60)
-        cleanup_expired_sessions()
+        time.sleep(EXPIRY_SWEEP_INTERVAL)
+        try:
+            state_engine.call(cleanup_expired_sessions)
+        except Exception as e:
+            debug_log(f"❌ Cleanup failed: {e}")
 
-# Start cleanup thread
-cleanup_thread = threading.Thread(target=session_cleanup_worker, daemon=True)
+cleanup_thread = threading.Thread(target=session_cleanup_worker, name='cleanup', daemon=True)
 cleanup_thread.start()
 
+# Crash-safe restart of the in-memory backend: session state is snapshotted
+# periodically and, on start, rebuilt from the snapshot plus the device_auth
+# and event rows written after it
+STATE_SNAPSHOT_PATH = os.environ.get('UVNC_STATE_SNAPSHOT', '/tmp/repeater_state.snapshot.json')
+STATE_SNAPSHOT_INTERVAL = 30  # seconds
+STATE_SNAPSHOT_VERSION = 2
+# Partitions before the snapshot still scanned for events stamped late by the repeater
+STATE_REPLAY_MARGIN = 3600
+state_snapshots_enabled = False
+# Set while replaying rows that already reached the database
+replaying_events = False
+
+def capture_state():
+    """Engine command: sessions and repeater sessions as plain rows, consistent with the event ids"""
+    registry = session_registry
+    return {
+        'version': STATE_SNAPSHOT_VERSION,
+        'taken_at': time.time(),
+        'last_event_id': registry.id_counters.get('events', last_event_id + 1) - 1,
+        'last_auth_id': registry.id_counters.get('device_auth', last_auth_id + 1) - 1,
+        'last_removal_id': registry.id_counters.get('dashboard_removals', last_removal_id + 1) - 1,
+        'session_fields': SessionRecord.__slots__,
+        'sessions': [[getattr(record, name) for name in SessionRecord.__slots__]
+                     for record in registry.sessions.values()],
+        'active_fields': ActiveSession.__slots__,
+        'active': [[getattr(session, name) for name in ActiveSession.__slots__]
+                   for session in registry.active.values()],
+    }
+
+def save_state_snapshot():
+    """Write the state snapshot atomically; serialization runs off the engine thread"""
+    state = state_engine.call(capture_state, timeout=None)
+    tmp_path = STATE_SNAPSHOT_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, STATE_SNAPSHOT_PATH)
+    debug_log(f"📸 State snapshot: {len(state['sessions'])} sessions, event id {state['last_event_id']}")
+
+def state_snapshot_worker():
+    while True:
+        time.sleep(STATE_SNAPSHOT_INTERVAL)
+        try:
+            save_state_snapshot()
+        except Exception as e:
+            debug_log(f"❌ State snapshot failed: {e}")
+
+def load_state_snapshot():
+    """Snapshot written by save_state_snapshot(), None when missing or unreadable"""
+    try:
+        with open(STATE_SNAPSHOT_PATH) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Warning: state snapshot {STATE_SNAPSHOT_PATH} ignored: {e}")
+        return None
+    if state.get('version') != STATE_SNAPSHOT_VERSION:
+        print(f"Warning: state snapshot {STATE_SNAPSHOT_PATH} has unknown version {state.get('version')}")
+        return None
+    return state
+
+def load_replay_rows(taken_at, after_auth_id, after_event_id, after_removal_id):
+    """device_auth, event and dashboard_removals rows written after the snapshot, in processing order.
+
+    Items are (timestamp, kind, id, row) with kind 0 for device_auth rows so
+    a slot taken in the same second as a SERVER_CONNECT is there to be linked,
+    and kind 2 for removals, applied after that second's events.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        # Ordered by whole seconds like the repeater's event timestamps
+        auth_rows = [(int(row[5]), 0, row[0], row) for row in conn.execute('''
+            SELECT id, serial_id, session_id, client_ip, server_slot,
+                   COALESCE(created_ts, CAST(strftime('%s', created_at) AS INTEGER))
+            FROM device_auth WHERE id > ?
+            ORDER BY id
+        ''', (after_auth_id,))]
+        removal_rows = [(int(row[2]), 2, row[0], row) for row in conn.execute('''
+            SELECT id, session_id, removed_at FROM dashboard_removals WHERE id > ? ORDER BY id
+        ''', (after_removal_id,))]
+        event_rows = []
+        for name, _, _ in partitions_overlapping(since=taken_at - STATE_REPLAY_MARGIN):
+            event_rows.extend(query_partition(conn, f'''
+                SELECT id, event_type, timestamp, repeater_pid, viewer_ip, server_ip,
+                       connection_code, mode, viewer_table_index, server_table_index
+                FROM {name} WHERE id > ?
+            ''', (after_event_id,)))
+    finally:
+        conn.close()
+    # Ids follow the order the events were processed in
+    event_rows.sort()
+    return list(heapq.merge(auth_rows, [(row[2], 1, row[0], row) for row in event_rows], removal_rows,
+                            key=lambda item: item[:3]))
+
+def restore_state():
+    """Engine command: rebuild in-memory sessions after a restart, returns (sessions, replayed rows)"""
+    global replaying_events
+    state = load_state_snapshot()
+    if state is None:
+        return 0, 0
+    names = state['session_fields']
+    # Slot setters by snapshot column; fields added since the snapshot keep __init__ defaults
+    setters = [getattr(SessionRecord, name).__set__ if name in SessionRecord.__slots__ else None
+               for name in names]
+    complete = set(SessionRecord.__slots__) <= set(names)
+    key_columns = [names.index(name) for name in ('session_id', 'serial_id', 'client_ip', 'server_slot', 'created_at')]
+    for values in state['sessions']:
+        if complete:
+            record = SessionRecord.__new__(SessionRecord)
+        else:
+            record = SessionRecord(*[values[column] for column in key_columns])
+        for setter, value in zip(setters, values):
+            if setter:
+                setter(record, value)
+        if record.authorized or record.on_dashboard:
+            session_registry.add(record)
+    for values in state['active']:
+        fields = dict(zip(state['active_fields'], values))
+        session_registry.set_active(ActiveSession(**{name: value for name, value in fields.items()
+                                                     if name in ActiveSession.__slots__}))
+    # Ids up to the snapshot may have been lost with the writer queue; never hand them out again
+    session_registry.reserve_ids('events', 0, state['last_event_id'])
+    session_registry.reserve_ids('device_auth', 0, state['last_auth_id'])
+    # Snapshots from before removals were logged: every logged removal is replayed
+    last_removal = state.get('last_removal_id', 0)
+    session_registry.reserve_ids('dashboard_removals', 0, last_removal)
+    rows = load_replay_rows(state['taken_at'], state['last_auth_id'], state['last_event_id'], last_removal)
+    replaying_events = True
+    try:
+        for _, kind, _, row in rows:
+            if kind == 0:
+                _, serial_id, session_id, client_ip, server_slot, created_at = row
+                if session_id not in session_registry:
+                    session_registry.add(SessionRecord(session_id, serial_id, client_ip, server_slot, created_at))
+            elif kind == 2:
+                hide_dashboard_connection(row[1])
+            else:
+                process_event({
+                    'event_type': row[1],
+                    'timestamp': row[2],
+                    'repeater_pid': row[3],
+                    'viewer_ip': row[4] or '',
+                    'server_ip': row[5] or '',
+                    'connection_code': row[6],
+                    'mode': row[7],
+                    'viewer_table_index': row[8],
+                    'server_table_index': row[9],
+                    'max_sessions': 0
+                })
+    finally:
+        replaying_events = False
+    return len(state['sessions']), len(rows)
+
+def start_state_snapshots():
+    """Restore in-memory state and keep snapshotting it; shared backends persist on their own"""
+    global state_snapshots_enabled
+    if session_registry.shared:
+        return
+    started = time.perf_counter()
+    sessions, replayed = state_engine.call(restore_state, timeout=None)
+    if sessions or replayed:
+        print(f"Restored {sessions} sessions from {STATE_SNAPSHOT_PATH} and replayed {replayed} rows "
+              f"in {time.perf_counter() - started:.3f}s")
+    state_snapshots_enabled = True
+    threading.Thread(target=state_snapshot_worker, name='state-snapshot', daemon=True).start()
+
 # noVNC client page
 @app.route('/vnc/<int:session_id>')
 def novnc_client(session_id):
     """Serve noVNC client for specific session"""
-    if session_id not in dashboard_connections:
+    if session_id not in state_engine.snapshot:
         return "Session not found or expired", 404
     server_host = get_server_host(request)
     return render_template('novnc.html', 
                          session_id=session_id,
-                         websockify_port=WEBSOCKIFY_PORT,
+                         proxy_port=VNC_PROXY_PORT,
                          server_host=server_host)
 
 # Graceful shutdown
@@ -775,7 +3477,15 @@ import signal
 
 def cleanup():
     """Clean up on shutdown"""
-    stop_websockify()
+    if vnc_proxy:
+        vnc_proxy.stop()
+    if state_snapshots_enabled:
+        try:
+            save_state_snapshot()
+        except Exception as e:
+            print(f"Warning: state snapshot not saved: {e}")
+    # Flush queued DB writes before exit
+    db_writer.stop()
 
 atexit.register(cleanup)
 
@@ -786,16 +3496,6 @@ def signal_handler(sig, frame):
 signal.signal(signal.SIGTERM, signal_handler)
 signal.signal(signal.SIGINT, signal_handler)
 
-def is_ultravnc_repeater_running():
-    """Check if UltraVNC repeater is running on port 5500"""
-    try:
-        for conn in psutil.net_connections():
-            if conn.laddr.port == 5500 and conn.status == 'LISTEN':
-                return True
-        return False
-    except:
-        return False
-
 if __name__ == '__main__':
     print("Starting VNC Repeater Event Listener on port 80...")
     print("Dashboard available at: http://0.0.0.0:80/dashboard")
@@ -807,11 +3507,22 @@ if __name__ == '__main__':
         print(f"Warning: noVNC not found at {NOVNC_PATH}")
     # Initialize repeater heartbeat
     repeater_last_heartbeat = time.time()
-    # Start websockify
-    if start_websockify():
-        print("Websockify proxy ready")
-        print(f"🔌 VNC Proxy: ws://0.0.0.0:{WEBSOCKIFY_PORT}/websockify")
-        app.run(host='0.0.0.0', port=80, debug=False)
-    else:
-        print("Failed to start websockify, exiting...")
+    schedule_heartbeat_expiry()
+    # Rebuild in-memory sessions before new events arrive
+    start_state_snapshots()
+    # Start repeater event stream listener
+    try:
+        start_event_listener()
+        print(f"Repeater event listener on {EVENT_LISTENER_HOST}:{EVENT_LISTENER_PORT}")
+    except OSError as e:
+        print(f"Warning: repeater event listener not started: {e}")
+    # Start VNC proxy
+    try:
+        start_vnc_proxy()
+    except OSError as e:
+        print(f"Failed to start VNC proxy: {e}, exiting...")
         exit(1)
+    start_health_prober()
+    start_resource_sampler()
+    print(f"🔌 VNC Proxy: ws://0.0.0.0:{VNC_PROXY_PORT}/vnc/<session_id>")
+    app.run(host='0.0.0.0', port=80, debug=False)
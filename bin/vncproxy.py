@@ -0,0 +1,488 @@
+"""WebSocket to UltraVNC repeater proxy for noVNC viewers.
+
+A browser opens ws://<host>:<port>/vnc/<session_id>. The proxy resolves the
+session to its repeater connection code, connects to the repeater viewer
+port, answers the repeater handshake with ID:<code> and then pumps bytes
+both ways: binary WebSocket frames to the browser, raw RFB to the repeater.
+
+Repeater data is received straight into a preallocated buffer
+(asyncio.BufferedProtocol) and framed without copying; each direction
+pauses reading on the other side once WRITE_HIGH_WATER bytes are queued.
+
+Run as a script this module is one proxy worker: app.py starts several,
+all bound to the same port with SO_REUSEPORT, and talks to each over a
+control socket carrying newline-delimited JSON (routes in, health and
+viewer notifications out). The module has no import side effects.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+import socket
+import struct
+import sys
+import time
+from array import array
+
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+RFB_VERSION_SIZE = 12  # "RFB 000.000\n" sent by the repeater to viewers
+REPEATER_ID_SIZE = 250  # MAX_HOST_NAME_LEN in repeater.cpp
+READ_BUFFER_SIZE = 64 * 1024
+WRITE_HIGH_WATER = 256 * 1024  # bytes queued to one side before the other side pauses
+MAX_HANDSHAKE_SIZE = 8192
+MAX_FRAME_SIZE = 1024 * 1024  # browser -> repeater frames are small input events
+HANDSHAKE_TIMEOUT = 10
+HEALTH_INTERVAL = 5  # seconds between worker health messages
+TRAFFIC_INTERVAL = 1  # seconds between per-session traffic reports
+TRAFFIC_WINDOWS = (1, 10, 60)  # rolling throughput windows, seconds
+TRAFFIC_SLOTS = 60  # per-second byte counts kept for each direction
+PING_INTERVAL = 10  # seconds between WebSocket pings used to measure RTT
+RTT_SAMPLES = 8
+
+REQUEST_PATH = re.compile(r'^/vnc/(\d+)/?(?:\?.*)?$')
+
+OP_CONTINUATION, OP_TEXT, OP_BINARY = 0x0, 0x1, 0x2
+OP_CLOSE, OP_PING, OP_PONG = 0x8, 0x9, 0xA
+
+def frame_header(opcode, length):
+    """Unmasked server -> client frame header"""
+    if length < 126:
+        return struct.pack('!BB', 0x80 | opcode, length)
+    if length < 65536:
+        return struct.pack('!BBH', 0x80 | opcode, 126, length)
+    return struct.pack('!BBQ', 0x80 | opcode, 127, length)
+
+def unmask(payload, mask):
+    """XOR payload with the 4-byte client mask"""
+    length = len(payload)
+    if not length:
+        return b''
+    key = (mask * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, 'little') ^ int.from_bytes(key, 'little')).to_bytes(length, 'little')
+
+def http_response(status, headers=()):
+    lines = [f'HTTP/1.1 {status}'] + [f'{name}: {value}' for name, value in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+class SessionTraffic:
+    """Byte and message counters of one session with per-second ring buffers.
+
+    "in" is browser -> repeater (input), "out" is repeater -> browser
+    (framebuffer). Slot second % TRAFFIC_SLOTS holds the bytes of that
+    second; slots of idle seconds are zeroed when time moves on.
+    """
+
+    __slots__ = ('bytes_in', 'bytes_out', 'messages_in', 'messages_out',
+                 'ring_in', 'ring_out', 'second', 'rtt', 'rtt_count')
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.messages_in = 0
+        self.messages_out = 0
+        self.ring_in = array('Q', bytes(8 * TRAFFIC_SLOTS))
+        self.ring_out = array('Q', bytes(8 * TRAFFIC_SLOTS))
+        self.second = int(time.monotonic())
+        self.rtt = array('d', bytes(8 * RTT_SAMPLES))
+        self.rtt_count = 0
+
+    def advance(self):
+        second = int(time.monotonic())
+        if second != self.second:
+            for slot in range(self.second + 1, min(second, self.second + TRAFFIC_SLOTS) + 1):
+                self.ring_in[slot % TRAFFIC_SLOTS] = 0
+                self.ring_out[slot % TRAFFIC_SLOTS] = 0
+            self.second = second
+
+    def add_in(self, nbytes):
+        self.advance()
+        self.bytes_in += nbytes
+        self.messages_in += 1
+        self.ring_in[self.second % TRAFFIC_SLOTS] += nbytes
+
+    def add_out(self, nbytes):
+        self.advance()
+        self.bytes_out += nbytes
+        self.messages_out += 1
+        self.ring_out[self.second % TRAFFIC_SLOTS] += nbytes
+
+    def add_rtt(self, seconds):
+        self.rtt[self.rtt_count % RTT_SAMPLES] = seconds
+        self.rtt_count += 1
+
+    def rate(self, ring, window):
+        """Average bytes/s over the last window completed seconds"""
+        return sum(ring[(self.second - offset) % TRAFFIC_SLOTS] for offset in range(1, window + 1)) / window
+
+    def report(self):
+        self.advance()
+        report = {
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'messages_in': self.messages_in,
+            'messages_out': self.messages_out,
+        }
+        for window in TRAFFIC_WINDOWS:
+            report[f'rate_in_{window}s'] = self.rate(self.ring_in, window)
+            report[f'rate_out_{window}s'] = self.rate(self.ring_out, window)
+        samples = self.rtt[:min(self.rtt_count, RTT_SAMPLES)]
+        report['rtt_ms'] = round(self.rtt[(self.rtt_count - 1) % RTT_SAMPLES] * 1000, 1) if samples else None
+        report['rtt_avg_ms'] = round(sum(samples) / len(samples) * 1000, 1) if samples else None
+        return report
+
+class ViewerConnection(asyncio.Protocol):
+    """Browser side: HTTP upgrade, then masked WebSocket frames in, binary frames out"""
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.transport = None
+        self.repeater = None
+        self.buffer = bytearray()
+        self.state = 'handshake'
+        self.session_id = None
+        self.peer_ip = ''
+        self.pending = []  # payloads received before the repeater connection is ready
+        self.timeout = None
+        self.traffic = None  # SessionTraffic shared by the session's viewers
+        self.pinger = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer_ip = (transport.get_extra_info('peername') or ('',))[0]
+        transport.set_write_buffer_limits(high=WRITE_HIGH_WATER)
+        self.timeout = asyncio.get_running_loop().call_later(HANDSHAKE_TIMEOUT, self.close)
+
+    def data_received(self, data):
+        self.buffer += data
+        if self.state == 'handshake':
+            self.read_handshake()
+        if self.state in ('connecting', 'open'):
+            self.read_frames()
+
+    def read_handshake(self):
+        end = self.buffer.find(b'\r\n\r\n')
+        if end < 0:
+            if len(self.buffer) > MAX_HANDSHAKE_SIZE:
+                self.reject('431 Request Header Fields Too Large')
+            return
+        request_line, *header_lines = self.buffer[:end].decode('latin-1').split('\r\n')
+        del self.buffer[:end + 4]
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        parts = request_line.split(' ')
+        match = REQUEST_PATH.match(parts[1]) if len(parts) == 3 and parts[0] == 'GET' else None
+        key = headers.get('sec-websocket-key')
+        if match is None or key is None or 'websocket' not in headers.get('upgrade', '').lower():
+            self.reject('400 Bad Request')
+            return
+        self.session_id = int(match.group(1))
+        # X-Forwarded-For when the proxy sits behind a reverse proxy on the same host
+        if self.peer_ip == '127.0.0.1' and headers.get('x-forwarded-for'):
+            self.peer_ip = headers['x-forwarded-for'].split(',')[0].strip()
+        connection_code = self.proxy.resolve(self.session_id)
+        if connection_code is None:
+            self.reject('404 Not Found')
+            return
+        accept = base64.b64encode(hashlib.sha1(key.encode('latin-1') + WS_GUID).digest()).decode()
+        response_headers = [('Upgrade', 'websocket'), ('Connection', 'Upgrade'),
+                            ('Sec-WebSocket-Accept', accept)]
+        protocols = [p.strip() for p in headers.get('sec-websocket-protocol', '').split(',')]
+        if 'binary' in protocols:
+            response_headers.append(('Sec-WebSocket-Protocol', 'binary'))
+        self.transport.write(http_response('101 Switching Protocols', response_headers))
+        self.state = 'connecting'
+        self.proxy.register(self)
+        asyncio.ensure_future(self.connect_repeater(connection_code))
+
+    def reject(self, status):
+        self.transport.write(http_response(status, [('Content-Length', '0'), ('Connection', 'close')]))
+        self.close()
+
+    async def connect_repeater(self, connection_code):
+        loop = asyncio.get_running_loop()
+        try:
+            _, repeater = await loop.create_connection(
+                lambda: RepeaterConnection(self, connection_code),
+                self.proxy.repeater_host, self.proxy.repeater_port)
+        except OSError as e:
+            self.proxy.log(f"❌ VNC proxy: repeater connection failed for session {self.session_id}: {e}")
+            self.close(1011)
+            return
+        if self.state == 'closed':
+            repeater.transport.close()
+            return
+        self.repeater = repeater
+
+    def repeater_ready(self):
+        """Repeater accepted the ID handshake, flush what the browser already sent"""
+        self.timeout.cancel()
+        self.state = 'open'
+        if self.pending:
+            self.repeater.transport.writelines(self.pending)
+            self.pending = []
+        self.pinger = asyncio.get_running_loop().call_later(PING_INTERVAL, self.ping)
+        self.proxy.log(f"🔌 VNC proxy: session {self.session_id} connected from {self.peer_ip}")
+
+    def read_frames(self):
+        buffer = self.buffer
+        while len(buffer) >= 2:
+            first, second = buffer[0], buffer[1]
+            opcode = first & 0x0F
+            length = second & 0x7F
+            offset = 2
+            if length == 126:
+                if len(buffer) < 4:
+                    return
+                length = struct.unpack_from('!H', buffer, 2)[0]
+                offset = 4
+            elif length == 127:
+                if len(buffer) < 10:
+                    return
+                length = struct.unpack_from('!Q', buffer, 2)[0]
+                offset = 10
+            if not second & 0x80 or length > MAX_FRAME_SIZE:
+                # Client frames must be masked (RFC 6455 5.1)
+                self.close(1002 if not second & 0x80 else 1009)
+                return
+            if len(buffer) < offset + 4 + length:
+                return
+            mask = bytes(buffer[offset:offset + 4])
+            payload = unmask(bytes(buffer[offset + 4:offset + 4 + length]), mask)
+            del buffer[:offset + 4 + length]
+            if opcode in (OP_CONTINUATION, OP_TEXT, OP_BINARY):
+                self.to_repeater(payload)
+            elif opcode == OP_PING:
+                self.transport.writelines([frame_header(OP_PONG, len(payload)), payload])
+            elif opcode == OP_PONG and len(payload) == 8:
+                self.traffic.add_rtt(time.monotonic() - struct.unpack('!d', payload)[0])
+            elif opcode == OP_CLOSE:
+                self.close(1000)
+                return
+
+    def to_repeater(self, payload):
+        self.traffic.add_in(len(payload))
+        if self.state == 'open':
+            self.repeater.transport.write(payload)
+        else:
+            self.pending.append(payload)
+
+    def send(self, data):
+        """Send repeater bytes as one binary frame; data may be a memoryview"""
+        self.traffic.add_out(len(data))
+        self.transport.writelines([frame_header(OP_BINARY, len(data)), data])
+
+    def ping(self):
+        """Ping carrying the send time, the browser's pong gives the RTT"""
+        if self.state == 'open':
+            self.transport.writelines([frame_header(OP_PING, 8), struct.pack('!d', time.monotonic())])
+            self.pinger = asyncio.get_running_loop().call_later(PING_INTERVAL, self.ping)
+
+    def pause_writing(self):
+        # Browser is slow: stop reading from the repeater until it drains
+        if self.repeater is not None:
+            self.repeater.transport.pause_reading()
+
+    def resume_writing(self):
+        if self.repeater is not None:
+            self.repeater.transport.resume_reading()
+
+    def close(self, code=None):
+        if self.state == 'closed':
+            return
+        if code is not None and self.state != 'handshake' and not self.transport.is_closing():
+            self.transport.write(frame_header(OP_CLOSE, 2) + struct.pack('!H', code))
+        self.state = 'closed'
+        self.transport.close()
+
+    def connection_lost(self, exc):
+        if self.timeout is not None:
+            self.timeout.cancel()
+        if self.pinger is not None:
+            self.pinger.cancel()
+        self.state = 'closed'
+        self.proxy.unregister(self)
+        if self.repeater is not None:
+            self.repeater.transport.close()
+
+class RepeaterConnection(asyncio.BufferedProtocol):
+    """Repeater side: reads RFB data into a reusable buffer and hands slices to the browser"""
+
+    def __init__(self, viewer, connection_code):
+        self.viewer = viewer
+        self.connection_code = connection_code
+        self.transport = None
+        self.buffer = bytearray(READ_BUFFER_SIZE)
+        self.filled = 0  # handshake bytes received so far
+        self.handshake = True
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=WRITE_HIGH_WATER)
+
+    def get_buffer(self, sizehint):
+        if self.handshake:
+            return memoryview(self.buffer)[self.filled:RFB_VERSION_SIZE]
+        return memoryview(self.buffer)
+
+    def buffer_updated(self, nbytes):
+        if self.handshake:
+            self.filled += nbytes
+            if self.filled < RFB_VERSION_SIZE:
+                return
+            if not self.buffer.startswith(b'RFB '):
+                self.viewer.proxy.log(f"❌ VNC proxy: unexpected repeater greeting {bytes(self.buffer[:12])!r}")
+                self.transport.close()
+                return
+            self.handshake = False
+            self.transport.write(f'ID:{self.connection_code}'.encode().ljust(REPEATER_ID_SIZE, b'\0'))
+            self.viewer.repeater_ready()
+            return
+        self.viewer.send(memoryview(self.buffer)[:nbytes])
+        if self.viewer.transport.get_write_buffer_size():
+            # The transport may still reference this buffer, read into a fresh one
+            self.buffer = bytearray(READ_BUFFER_SIZE)
+
+    def pause_writing(self):
+        self.viewer.transport.pause_reading()
+
+    def resume_writing(self):
+        self.viewer.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        self.viewer.close(1000)
+
+class VncProxy:
+    """WebSocket listener routing /vnc/<session_id> sockets to repeater connection codes.
+
+    resolve(session_id) runs on the proxy event loop and returns the
+    repeater connection code, or None to refuse the session.
+    """
+
+    def __init__(self, resolve, host, port, repeater_host, repeater_port, log=print, on_viewer=None):
+        self.resolve = resolve
+        self.host = host
+        self.port = port
+        self.repeater_host = repeater_host
+        self.repeater_port = repeater_port
+        self.log = log
+        self.on_viewer = on_viewer  # callable (viewer, opened) on register/unregister
+        self.server = None
+        self.viewers = {}  # session_id -> set of open ViewerConnection
+        self.traffic = {}  # session_id -> SessionTraffic while it has viewers
+
+    async def start(self, reuse_port=False):
+        loop = asyncio.get_running_loop()
+        self.server = await loop.create_server(
+            lambda: ViewerConnection(self), self.host, self.port,
+            reuse_address=True, reuse_port=reuse_port)
+        return self.server
+
+    def is_serving(self):
+        return self.server is not None and self.server.is_serving()
+
+    def register(self, viewer):
+        self.viewers.setdefault(viewer.session_id, set()).add(viewer)
+        viewer.traffic = self.traffic.setdefault(viewer.session_id, SessionTraffic())
+        if self.on_viewer is not None:
+            self.on_viewer(viewer, True)
+
+    def unregister(self, viewer):
+        viewers = self.viewers.get(viewer.session_id)
+        if viewers is not None and viewer in viewers:
+            viewers.discard(viewer)
+            if not viewers:
+                del self.viewers[viewer.session_id]
+                del self.traffic[viewer.session_id]
+            if self.on_viewer is not None:
+                self.on_viewer(viewer, False)
+
+    def connection_count(self):
+        return sum(len(viewers) for viewers in self.viewers.values())
+
+    def viewer_ips(self, session_id):
+        return [viewer.peer_ip for viewer in list(self.viewers.get(session_id, ()))]
+
+class ProxyWorker:
+    """Worker process side of the control socket"""
+
+    def __init__(self, args):
+        self.args = args
+        self.routes = {}  # session_id -> connection code, pushed by app.py
+        self.writer = None
+        self.proxy = VncProxy(self.routes.get, args.host, args.port, args.repeater_host,
+                              args.repeater_port, log=self.log, on_viewer=self.viewer_changed)
+
+    def log(self, message):
+        if self.args.debug:
+            print(f"[vnc-proxy {self.args.index}] {message}", flush=True)
+
+    def send(self, message):
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(json.dumps(message).encode() + b'\n')
+
+    def viewer_changed(self, viewer, opened):
+        self.send({'viewer': [viewer.session_id, viewer.peer_ip, opened]})
+
+    async def run(self):
+        control = socket.socket(fileno=self.args.control_fd)
+        reader, self.writer = await asyncio.open_connection(sock=control)
+        await self.proxy.start(reuse_port=True)
+        self.send({'ready': os.getpid()})
+        reports = [asyncio.ensure_future(self.report_health()), asyncio.ensure_future(self.report_traffic())]
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break  # app.py went away
+                self.handle(json.loads(line))
+        finally:
+            for report in reports:
+                report.cancel()
+
+    def handle(self, message):
+        if 'routes' in message:
+            self.routes.clear()
+            self.routes.update((int(session_id), code) for session_id, code in message['routes'].items())
+        for session_id, code in message.get('route', {}).items():
+            self.routes[int(session_id)] = code
+        for session_id in message.get('unroute', ()):
+            self.routes.pop(session_id, None)
+
+    async def report_traffic(self):
+        reported = False
+        while True:
+            await asyncio.sleep(TRAFFIC_INTERVAL)
+            # One empty report after the last session closes clears it in app.py
+            if self.proxy.traffic or reported:
+                self.send({'traffic': {session_id: traffic.report()
+                                       for session_id, traffic in self.proxy.traffic.items()}})
+                reported = bool(self.proxy.traffic)
+
+    async def report_health(self):
+        while True:
+            self.send({'health': {'connections': self.proxy.connection_count(), 'routes': len(self.routes)}})
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+def main():
+    parser = argparse.ArgumentParser(description='noVNC WebSocket proxy worker')
+    parser.add_argument('--index', type=int, default=0)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--repeater-host', default='127.0.0.1')
+    parser.add_argument('--repeater-port', type=int, default=5900)
+    parser.add_argument('--control-fd', type=int, required=True)
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+    try:
+        asyncio.run(ProxyWorker(args).run())
+    except OSError as e:
+        print(f"[vnc-proxy {args.index}] ❌ {e}", flush=True)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
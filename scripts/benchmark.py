@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Microbenchmarks for the listener's hot paths at fleet-scale session counts.
+
+For each population size (--sizes, default 100, 10k and 100k sessions; half
+of them linked to a connection code with an active repeater session) it
+measures:
+
+  parse_event_data, format_ip, process_event for every event type,
+  store_event, /api/dashboard/connections, cleanup_expired_sessions
+  and /api/vnc/server/take_slot
+
+and records throughput, p50/p99 latency and the traced memory (peak and
+retained) of building the population. State-changing benchmarks run as
+one command on the state engine thread, like production mutations;
+HTTP routes go through the Flask test client.
+
+--save writes the results as a JSON baseline; --compare checks a run
+against a baseline and exits with status 1 when any benchmark loses more
+than --threshold of its throughput or a population needs that much more
+memory.
+
+  python3 scripts/benchmark.py --save baseline.json
+  python3 scripts/benchmark.py --compare baseline.json --threshold 0.25
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# The app creates its database, threads and state backend on import
+BENCH_DIR = tempfile.mkdtemp(prefix='uvnc-bench-')
+os.environ['UVNC_EVENTS_DB'] = os.path.join(BENCH_DIR, 'events.db')
+os.environ['UVNC_STATE_BACKEND'] = 'memory'
+# Every request comes from one address; measure the routes, not the limiter
+os.environ['UVNC_RATE_LIMIT'] = '0'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin'))
+os.chdir(sys.path[0])
+
+import app  # noqa: E402
+
+LINKED_CODE_BASE = 100000000
+NEW_CODE_BASE = 500000000
+SESSION_ID_BASE = 1000000000
+
+def session_ip(index):
+    return f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"
+
+def raw_event(event_type, code=0, ip='', viewer_ip='', server_ip=''):
+    return {
+        'EvMsgVer': '1', 'EvNum': str(app.EVENT_TYPES.index(event_type)), 'Time': str(int(time.time())),
+        'Pid': '4242', 'Code': str(code), 'Mode': '2', 'Ip': ip, 'VwrIp': viewer_ip, 'SvrIp': server_ip,
+        'TblInd': '1', 'SvrTblInd': '2', 'MaxSessions': '100'
+    }
+
+def reset_state():
+    """Engine command: empty registry, snapshot and expiry deadlines"""
+    old = app.session_registry
+    app.session_registry = app.create_state_backend('memory')
+    app.session_registry.listeners = old.listeners
+    with app.expiry_scheduler.condition:
+        app.expiry_scheduler.heap.clear()
+        app.expiry_scheduler.entries.clear()
+    app.state_engine.resync()
+
+def populate(size):
+    """Engine command: size sessions, odd ones linked with an active repeater session"""
+    now = time.time()
+    registry = app.session_registry
+    for index in range(size):
+        session_id = SESSION_ID_BASE + index
+        ip = session_ip(index)
+        record = app.SessionRecord(session_id, f'bench-{index}', ip, 'bench:5500', now)
+        registry.add(record)
+        if index % 2:
+            code = LINKED_CODE_BASE + index
+            registry.update(record, connection_code=code, mapped=True, server_connected=True,
+                            server_ip=ip, server_connect_time=now)
+            registry.set_active(app.ActiveSession(code, server_ip=ip, mode=2, start_time=now,
+                                                  session_id=session_id))
+
+def measure(func, calls):
+    """Run func(call) for every call, returns per-call latencies in seconds"""
+    latencies = []
+    clock = time.perf_counter
+    for call in calls:
+        started = clock()
+        func(call)
+        latencies.append(clock() - started)
+    return latencies
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        'calls': len(latencies),
+        'ops_per_sec': round(len(latencies) / total, 1) if total else None,
+        'p50_us': round(latencies[len(latencies) // 2] * 1e6, 2),
+        'p99_us': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6, 2),
+    }
+
+def engine_benchmarks(size, iterations):
+    """Benchmarks that touch session state, run on the state engine thread"""
+    results = {}
+    linked = list(range(1, size, 2))
+    pending = list(range(0, size, 2))
+    count = max(1, min(iterations, len(linked) // 2, len(pending)))
+    flow_codes = [LINKED_CODE_BASE + index for index in linked[:count]]
+    disconnect_codes = [LINKED_CODE_BASE + index for index in linked[count:2 * count]]
+    parse = app.parse_event_data
+
+    def run_events(event_type, raws):
+        events = [parse(raw) for raw in raws]
+        results[f'process_event[{event_type}]'] = summarize(measure(app.process_event, events))
+
+    run_events('VIEWER_CONNECT', [raw_event('VIEWER_CONNECT', code, ip='192.168.0.10') for code in flow_codes])
+    run_events('VIEWER_DISCONNECT', [raw_event('VIEWER_DISCONNECT', code, ip='192.168.0.10') for code in flow_codes])
+    run_events('VIEWER_SERVER_SESSION_START', [
+        raw_event('VIEWER_SERVER_SESSION_START', code, viewer_ip='192.168.0.10', server_ip=session_ip(code - LINKED_CODE_BASE))
+        for code in flow_codes])
+    run_events('VIEWER_SERVER_SESSION_END', [
+        raw_event('VIEWER_SERVER_SESSION_END', code, viewer_ip='192.168.0.10', server_ip=session_ip(code - LINKED_CODE_BASE))
+        for code in flow_codes])
+    run_events('SERVER_CONNECT', [raw_event('SERVER_CONNECT', NEW_CODE_BASE + index, ip=session_ip(index))
+                                  for index in pending[:count]])
+    run_events('SERVER_DISCONNECT', [raw_event('SERVER_DISCONNECT', code, ip=session_ip(code - LINKED_CODE_BASE))
+                                     for code in disconnect_codes])
+    for event_type in ('REPEATER_STARTUP', 'REPEATER_SHUTDOWN', 'REPEATER_HEARTBEAT'):
+        run_events(event_type, [raw_event(event_type) for _ in range(count)])
+
+    events = [parse(raw_event('VIEWER_DISCONNECT', LINKED_CODE_BASE + index, ip='192.168.0.10'))
+              for index in range(count)]
+    results['store_event'] = summarize(measure(app.store_event, events))
+    results['cleanup_expired_sessions'] = summarize(measure(lambda _: app.cleanup_expired_sessions(),
+                                                            range(max(1, min(20, count)))))
+    return results
+
+def run_size(size, iterations, client):
+    app.state_engine.call(reset_state, timeout=None)
+    tracemalloc.start()
+    started = time.perf_counter()
+    app.state_engine.call(populate, size, timeout=None)
+    build_seconds = time.perf_counter() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {
+        'population': {
+            'sessions': size,
+            'build_seconds': round(build_seconds, 3),
+            'memory_retained_bytes': retained,
+            'memory_peak_bytes': peak,
+        }
+    }
+    count = max(1, min(iterations, size))
+    raws = [raw_event('SERVER_CONNECT', LINKED_CODE_BASE + index, ip=session_ip(index)) for index in range(count)]
+    result['parse_event_data'] = summarize(measure(app.parse_event_data, raws))
+    ips = [str(index) if index % 2 else session_ip(index) for index in range(count)]
+    result['format_ip'] = summarize(measure(app.format_ip, ips))
+    # Dashboard reads the snapshot published after the population command
+    result['dashboard_connections'] = summarize(measure(
+        lambda _: client.get('/api/dashboard/connections'), range(max(1, min(50, count)))))
+    result.update(app.state_engine.call(engine_benchmarks, size, iterations, timeout=None))
+    result['take_slot'] = summarize(measure(
+        lambda index: client.post('/api/vnc/server/take_slot', json={'serial_id': f'bench-slot-{index}'}),
+        range(max(1, min(iterations, 500)))))
+    return result
+
+def compare(results, baseline, threshold):
+    """Regressions of results against baseline, as printable lines"""
+    regressions = []
+    for size, benchmarks in results['sizes'].items():
+        base_benchmarks = baseline['sizes'].get(size, {})
+        for name, entry in benchmarks.items():
+            base = base_benchmarks.get(name)
+            if base is None:
+                continue
+            if name == 'population':
+                if entry['memory_retained_bytes'] > base['memory_retained_bytes'] * (1 + threshold):
+                    regressions.append(f"{size} {name}: memory {base['memory_retained_bytes']} -> "
+                                       f"{entry['memory_retained_bytes']} bytes")
+            elif base['ops_per_sec'] and entry['ops_per_sec'] < base['ops_per_sec'] * (1 - threshold):
+                regressions.append(f"{size} {name}: {base['ops_per_sec']} -> {entry['ops_per_sec']} ops/s")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,10000,100000', help='comma separated session counts')
+    parser.add_argument('--iterations', type=int, default=2000, help='calls per benchmark (capped by population)')
+    parser.add_argument('--save', help='write results to this JSON baseline')
+    parser.add_argument('--compare', help='baseline JSON to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative regression')
+    args = parser.parse_args()
+
+    client = app.app.test_client()
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'sizes': {}
+    }
+    for size in (int(value) for value in args.sizes.split(',')):
+        print(f"== {size} sessions", file=sys.stderr)
+        results['sizes'][str(size)] = run_size(size, args.iterations, client)
+        for name, entry in results['sizes'][str(size)].items():
+            if name == 'population':
+                print(f"  {name:40} build {entry['build_seconds']}s, "
+                      f"{entry['memory_retained_bytes'] / 1048576:.1f} MiB retained, "
+                      f"{entry['memory_peak_bytes'] / 1048576:.1f} MiB peak", file=sys.stderr)
+            else:
+                print(f"  {name:40} {entry['ops_per_sec']:>12} ops/s  p50 {entry['p50_us']:>9} us  "
+                      f"p99 {entry['p99_us']:>9} us", file=sys.stderr)
+    results['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    app.db_writer.stop()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.save}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions over {args.threshold:.0%} against {args.compare}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""Event trace export and replay load generator for the VNC Repeater Event Listener.
+
+A trace is a JSONL file, one {"t": <seconds>, "event": {<raw repeater params>}}
+per line. Traces come from:
+
+  export   - rows of the events database (all partitions, time range)
+  capture  - UVNC_EVENT_TRACE=<file> on the listener records live events
+
+replay sends a trace to the listener, either as lines on the repeater event
+port (--listener, 'http' = GET /?... HTTP/1.0 lines or 'plain' = EvMsgVer:...
+lines) or as HTTP requests to /api/event (--api). --speed scales the gaps
+between events (1, 10, 100, ...; 0 = as fast as possible); --repeaters runs N
+simulated repeaters, each with its own connection, pid and connection codes.
+--devices adds synthetic devices calling take_slot.
+
+At the end it reports achieved events/sec, error rate and latency
+percentiles: per request for --api and take_slot, and end-to-end (event sent
+until visible in /api/events/tail) from probe events for --listener.
+
+Examples:
+  event_replay.py export --db /tmp/repeater_events.db --since 2024-05-01 -o trace.jsonl
+  event_replay.py replay trace.jsonl --listener 127.0.0.1:2002 --format http --speed 10
+  event_replay.py replay trace.jsonl --api http://127.0.0.1 --speed 0 --repeaters 8 --devices 4
+"""
+import argparse
+import json
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+# EvNum of each event type, see EVENT_TYPES in bin/app.py
+EVENT_NUMS = {
+    'VIEWER_CONNECT': 0,
+    'VIEWER_DISCONNECT': 1,
+    'SERVER_CONNECT': 2,
+    'SERVER_DISCONNECT': 3,
+    'VIEWER_SERVER_SESSION_START': 4,
+    'VIEWER_SERVER_SESSION_END': 5,
+    'REPEATER_STARTUP': 6,
+    'REPEATER_SHUTDOWN': 7,
+    'REPEATER_HEARTBEAT': 8,
+}
+SESSION_EVENTS = ('VIEWER_SERVER_SESSION_START', 'VIEWER_SERVER_SESSION_END')
+PROBE_CODE_BASE = 990000000  # connection codes used by latency probes
+PROBE_TIMEOUT = 10
+PROBE_POLL_INTERVAL = 0.05  # within the listener's default API rate limit (20/s)
+
+def row_to_event(row):
+    """Raw repeater parameters for one events table row"""
+    event_type, timestamp, pid, viewer_ip, server_ip, code, mode, viewer_index, server_index = row
+    event = {'EvMsgVer': 1, 'EvNum': EVENT_NUMS[event_type], 'Time': timestamp, 'Pid': pid}
+    if event_type in SESSION_EVENTS:
+        event.update(VwrIp=viewer_ip, SvrIp=server_ip)
+    elif event_type.startswith('VIEWER'):
+        event['Ip'] = viewer_ip
+    elif event_type.startswith('SERVER'):
+        event['Ip'] = server_ip
+    if not event_type.startswith('REPEATER'):
+        event.update(Code=code, Mode=mode)
+    if viewer_index is not None and viewer_index >= 0:
+        event['VwrTblInd'] = viewer_index
+    if server_index is not None and server_index >= 0:
+        event['SvrTblInd'] = server_index
+    return event
+
+def parse_time(value):
+    return int(datetime.fromisoformat(value).timestamp()) if value else None
+
+def export_trace(args):
+    conn = sqlite3.connect(args.db)
+    tables = ['events']
+    try:
+        tables = [name for name, in conn.execute('SELECT name FROM event_partitions ORDER BY start_ts')]
+    except sqlite3.OperationalError:
+        pass  # database from before partitioning
+    since, until = parse_time(args.since), parse_time(args.until)
+    rows = []
+    for table in tables:
+        try:
+            rows.extend(conn.execute(f'''
+                SELECT id, event_type, timestamp, repeater_pid, viewer_ip, server_ip,
+                       connection_code, mode, viewer_table_index, server_table_index
+                FROM {table}
+                WHERE timestamp >= ? AND timestamp < ?
+            ''', (since or 0, until or 2 ** 62)))
+        except sqlite3.OperationalError as e:
+            print(f"Skipping {table}: {e}", file=sys.stderr)
+    conn.close()
+    rows.sort(key=lambda row: (row[2], row[0]))
+    out = open(args.output, 'w') if args.output != '-' else sys.stdout
+    count = 0
+    for row in rows:
+        if row[1] in EVENT_NUMS:
+            out.write(json.dumps({'t': row[2], 'event': row_to_event(row[1:])}) + '\n')
+            count += 1
+    if out is not sys.stdout:
+        out.close()
+    print(f"Exported {count} events", file=sys.stderr)
+
+def load_trace(path):
+    with open(path) as f:
+        trace = [json.loads(line) for line in f if line.strip()]
+    if not trace:
+        sys.exit(f"{path}: empty trace")
+    start = trace[0]['t']
+    return [(item['t'] - start, item['event']) for item in trace]
+
+def format_line(event, line_format):
+    if line_format == 'http':
+        return f"GET /?{urllib.parse.urlencode(event)} HTTP/1.0\r\n\r\n"
+    return 'EvMsgVer:1,' + ','.join(f'{name}:{value}' for name, value in event.items() if name != 'EvMsgVer') + '\n'
+
+class Stats:
+    """Thread-safe counters and latency samples per operation"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = {}
+        self.errors = {}
+        self.latencies = {}
+
+    def record(self, name, latency=None, error=False):
+        with self.lock:
+            self.sent[name] = self.sent.get(name, 0) + 1
+            if error:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            elif latency is not None:
+                self.latencies.setdefault(name, []).append(latency)
+
+    def report(self, elapsed):
+        result = {'elapsed_seconds': round(elapsed, 3)}
+        with self.lock:
+            for name, sent in self.sent.items():
+                samples = sorted(self.latencies.get(name, ()))
+                errors = self.errors.get(name, 0)
+                entry = {'count': sent, 'per_second': round(sent / elapsed, 1) if elapsed else None,
+                         'errors': errors, 'error_rate': round(errors / sent, 4)}
+                if samples:
+                    for label, q in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+                        entry[f'{label}_ms'] = round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 2)
+                    entry['max_ms'] = round(samples[-1] * 1000, 2)
+                result[name] = entry
+        return result
+
+def simulated_event(event, index, args):
+    """Copy of a trace event for simulated repeater index"""
+    event = dict(event)
+    if 'Pid' in event:
+        event['Pid'] = int(event['Pid']) + index * args.pid_offset
+    if 'Code' in event and int(event['Code']):
+        event['Code'] = int(event['Code']) + index * args.code_offset
+    if not args.keep_time:
+        event['Time'] = int(time.time())
+    return event
+
+def http_request(url, data=None, timeout=10):
+    body = json.dumps(data).encode() if data is not None else None
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'} if body else {})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status, response.read()
+
+def replay_repeater(index, trace, args, stats, started):
+    """One simulated repeater sending the whole trace"""
+    sock = None
+    if args.listener:
+        host, _, port = args.listener.rpartition(':')
+        try:
+            sock = socket.create_connection((host, int(port)))
+        except OSError as e:
+            print(f"Repeater {index}: {e}", file=sys.stderr)
+            stats.record('events', error=True)
+            return
+    try:
+        for offset, event in trace:
+            if args.speed:
+                delay = started + offset / args.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            event = simulated_event(event, index, args)
+            if sock is not None:
+                try:
+                    sock.sendall(format_line(event, args.format).encode())
+                    stats.record('events')
+                except OSError:
+                    stats.record('events', error=True)
+                    return
+            else:
+                sent = time.perf_counter()
+                try:
+                    status, _ = http_request(f"{args.api}/api/event?{urllib.parse.urlencode(event)}")
+                    stats.record('events', time.perf_counter() - sent, error=status != 200)
+                except (OSError, urllib.error.HTTPError):
+                    stats.record('events', error=True)
+    finally:
+        if sock is not None:
+            sock.close()
+
+def run_device(index, args, stats, done):
+    """Synthetic device requesting slots until the replay ends"""
+    while not done.is_set():
+        sent = time.perf_counter()
+        try:
+            status, _ = http_request(f"{args.api}/api/vnc/server/take_slot", {'serial_id': f'replay-{index}'})
+            stats.record('take_slot', time.perf_counter() - sent, error=status != 200)
+        except (OSError, urllib.error.HTTPError):
+            stats.record('take_slot', error=True)
+        done.wait(args.slot_interval)
+
+def run_probes(args, stats, done):
+    """Send marker events on the listener port and time them until /api/events/tail shows them"""
+    host, _, port = args.listener.rpartition(':')
+    try:
+        sock = socket.create_connection((host, int(port)))
+        _, body = http_request(f"{args.api}/api/events/tail?limit=1")
+    except (OSError, urllib.error.HTTPError) as e:
+        print(f"Probes disabled: {e}", file=sys.stderr)
+        return
+    last_id = json.loads(body)['last_id']
+    code = PROBE_CODE_BASE
+    with sock:
+        # At least one probe, even for a replay shorter than probe_interval
+        while True:
+            code += 1
+            event = {'EvMsgVer': 1, 'EvNum': EVENT_NUMS['VIEWER_DISCONNECT'], 'Time': int(time.time()),
+                     'Pid': 0, 'Ip': '127.0.0.1', 'Code': code, 'Mode': 2}
+            sent = time.perf_counter()
+            seen = False
+            try:
+                sock.sendall(format_line(event, args.format).encode())
+                while not seen and time.perf_counter() - sent < PROBE_TIMEOUT:
+                    try:
+                        _, body = http_request(f"{args.api}/api/events/tail?after_id={last_id}&limit=1000")
+                    except urllib.error.HTTPError as e:
+                        if e.code not in (429, 503):
+                            raise
+                        # Rate limited or shed: wait as told and keep polling
+                        time.sleep(min(float(e.headers.get('Retry-After', 1)),
+                                       max(PROBE_TIMEOUT - (time.perf_counter() - sent), 0)))
+                        continue
+                    page = json.loads(body)
+                    last_id = page['last_id']
+                    seen = any(row['connection_code'] == code for row in page['events'])
+                    if not seen:
+                        time.sleep(PROBE_POLL_INTERVAL)
+            except (OSError, urllib.error.HTTPError):
+                pass
+            stats.record('end_to_end', time.perf_counter() - sent, error=not seen)
+            if done.wait(args.probe_interval):
+                break
+
+def replay(args):
+    if not (args.listener or args.api):
+        sys.exit("replay needs --listener and/or --api")
+    if args.devices and not args.api:
+        sys.exit("--devices needs --api")
+    trace = load_trace(args.trace)
+    stats = Stats()
+    done = threading.Event()
+    helpers = [threading.Thread(target=run_device, args=(index, args, stats, done), daemon=True)
+               for index in range(args.devices)]
+    if args.listener and args.api and args.probe_interval > 0:
+        helpers.append(threading.Thread(target=run_probes, args=(args, stats, done), daemon=True))
+    started = time.time()
+    repeaters = [threading.Thread(target=replay_repeater, args=(index, trace, args, stats, started))
+                 for index in range(args.repeaters)]
+    for thread in helpers + repeaters:
+        thread.start()
+    for thread in repeaters:
+        thread.join()
+    elapsed = time.time() - started
+    done.set()
+    for thread in helpers:
+        thread.join(PROBE_TIMEOUT)
+    result = stats.report(elapsed)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"Replayed {len(trace)} events x {args.repeaters} repeater(s) in {result['elapsed_seconds']}s")
+    for name, entry in result.items():
+        if name == 'elapsed_seconds':
+            continue
+        latency = ', '.join(f"{key[:-3]} {value} ms" for key, value in entry.items() if key.endswith('_ms'))
+        print(f"  {name:12} {entry['count']:8} sent  {entry['per_second']:>10}/s  "
+              f"errors {entry['errors']} ({entry['error_rate']:.2%})" + (f"  {latency}" if latency else ''))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help='export events from the database as a trace')
+    export.add_argument('--db', default='/tmp/repeater_events.db')
+    export.add_argument('--since', help='ISO date/time, inclusive')
+    export.add_argument('--until', help='ISO date/time, exclusive')
+    export.add_argument('-o', '--output', default='-')
+    export.set_defaults(func=export_trace)
+
+    play = commands.add_parser('replay', help='replay a trace against the listener')
+    play.add_argument('trace')
+    play.add_argument('--listener', help='repeater event port, host:port (e.g. 127.0.0.1:2002)')
+    play.add_argument('--format', choices=('http', 'plain'), default='http',
+                      help='line format on the event port (repeater usehttp=1 / usehttp=0)')
+    play.add_argument('--api', help='listener base URL; events go to /api/event without --listener')
+    play.add_argument('--speed', type=float, default=1, help='time scale, 0 = as fast as possible')
+    play.add_argument('--repeaters', type=int, default=1, help='simulated repeaters')
+    play.add_argument('--code-offset', type=int, default=1000000, help='connection code offset per repeater')
+    play.add_argument('--pid-offset', type=int, default=100000, help='pid offset per repeater')
+    play.add_argument('--keep-time', action='store_true', help='send recorded Time instead of now')
+    play.add_argument('--devices', type=int, default=0, help='synthetic devices calling take_slot')
+    play.add_argument('--slot-interval', type=float, default=1.0, help='seconds between take_slot per device')
+    play.add_argument('--probe-interval', type=float, default=0.5,
+                      help='seconds between end-to-end latency probes (--listener with --api), 0 = off')
+    play.add_argument('--json', action='store_true', help='print the report as JSON')
+    play.set_defaults(func=replay)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -149,8 +149,8 @@ requirelistedid=0
 [eventinterface]
 useeventinterface=1
 eventlistenerhost=127.0.0.1
-eventlistenerport=80
-usehttp=1
+eventlistenerport=2002
+usehttp=0
 EOF
             print_success "Default configuration file created"
         fi